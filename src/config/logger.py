@@ -1,11 +1,136 @@
+import atexit
+import contextvars
+import json
 import logging
-from config.settings import DEBUG
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from config.settings import DEBUG, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLING_RATE
 
 logger = logging.getLogger(name='LikwidAdmin')
 logger.setLevel(logging.DEBUG)
 
 format = '%(asctime)s [%(levelname)s] %(filename)s: %(message)s'
-formatter = logging.Formatter(format, datefmt='%d.%m.%Y %H:%M:%S')
+datefmt = '%d.%m.%Y %H:%M:%S'
+
+# контекст обрабатываемого события (пользователь, игра, этап), добавляется ко всем записям
+log_context = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def logging_context(**values):
+    token = log_context.set({**log_context.get(), **values})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Контекст события в записи. Выполняется в потоке, который пишет в лог.
+    """
+
+    def filter(self, record):
+        record.context = log_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничение частоты записей ниже WARNING: не больше rate записей в секунду с одной строки кода.
+    Количество пропущенных записей указывается в следующей записанной записи с этой строки.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        # (файл, строка) -> [доступные записи, время пополнения, пропущено]
+        self.buckets: {tuple: list} = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.capacity, now, 0]
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.sampled_out, bucket[2] = bucket[2], 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Передача записей в очередь, которую разбирает QueueListener в отдельном потоке.
+    Запись кладётся в очередь как есть и форматируется обработчиками слушателя, а не в потоке события.
+    При переполнении очереди запись отбрасывается, количество отброшенных указывается в следующей записи.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # QueueHandler.prepare форматирует сообщение и исключение в вызывающем потоке
+        return record
+
+    def enqueue(self, record):
+        with self.dropped_lock:
+            record.queue_dropped = self.dropped
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            else:
+                self.dropped = 0
+
+
+def get_extra_fields(record) -> dict:
+    fields = dict(getattr(record, 'context', {}))
+    if getattr(record, 'sampled_out', 0):
+        fields['sampled_out'] = record.sampled_out
+    if getattr(record, 'queue_dropped', 0):
+        fields['queue_dropped'] = record.queue_dropped
+    return fields
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        fields = get_extra_fields(record)
+        if fields:
+            text += ' [' + ', '.join(f'{name}={value}' for name, value in fields.items()) + ']'
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'file': f'{record.filename}:{record.lineno}',
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        data.update(get_extra_fields(record))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
 
 if DEBUG:
     level = logging.DEBUG
@@ -17,7 +142,24 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(level)
 
 # добавляем formatter
-console_handler.setFormatter(formatter)
+if LOG_FORMAT == 'json':
+    console_handler.setFormatter(JsonFormatter())
+else:
+    console_handler.setFormatter(TextFormatter(format, datefmt=datefmt))
+
+if LOG_QUEUE_SIZE:
+    # вывод в консоль выполняется в отдельном потоке, оставшиеся записи выводятся при завершении процесса
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.setLevel(level)
+    listener = QueueListener(handler.queue, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+else:
+    handler = console_handler
+
+if LOG_SAMPLING_RATE:
+    handler.addFilter(SamplingFilter(LOG_SAMPLING_RATE))
+handler.addFilter(ContextFilter())
 
 # добавляем к logger
-logger.addHandler(console_handler)
\ No newline at end of file
+logger.addHandler(handler)
@@ -8,9 +8,33 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = environ.Env(
     DEBUG=(bool, False),
-    DATABASE_URL=(str, 'sqlite:///db.sqlite3'),
+    DATABASE_URL=(str, f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
     ALLOWED_HOSTS=(list[str], ['localhost', '127.0.0.1']),
-    VK_TOKEN=(str, '')
+    VK_TOKEN=(str, ''),
+    VK_BOT_TOKEN=(str, ''),
+    VK_STANDALONE_APP_ID=(str, ''),
+    VK_STANDALONE_APP_TOKEN=(str, ''),
+    VK_BOT_WORKERS=(int, 1),
+    VK_BOT_QUEUE_SIZE=(int, 100),
+    VK_CALLBACK_CONFIRMATION_CODE=(str, ''),
+    VK_CALLBACK_SECRET=(str, ''),
+    VK_BOT_RPS=(float, 20),
+    VK_STANDALONE_RPS=(float, 3),
+    VK_USERS_CACHE_SIZE=(int, 100000),
+    VK_USERS_CACHE_TTL=(int, 24 * 60 * 60),
+    VK_BOT_STATE_BACKEND=(str, 'memory'),
+    VK_BOT_STATE_TTL=(int, 60 * 60),
+    VK_BOT_STATE_REDIS_URL=(str, 'redis://127.0.0.1:6379/0'),
+    VK_BOT_JOBS_BACKEND=(str, 'memory'),
+    VK_BOT_JOB_WORKERS=(int, 2),
+    VK_BOT_METRICS_PORT=(int, 0),
+    VK_BOT_METRICS_TEXTFILE=(str, ''),
+    VK_BOT_QUERY_BUDGET=(int, 0),
+    VK_BOT_DUPLICATE_QUERY_BUDGET=(int, 0),
+    VK_BOT_QUERY_BUDGET_MODE=(str, 'warn'),
+    LOG_FORMAT=(str, 'text'),
+    LOG_QUEUE_SIZE=(int, 10000),
+    LOG_SAMPLING_RATE=(float, 0),
 )
 
 environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
@@ -66,11 +90,9 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# SQLite не допускает одновременной записи: с ним события обрабатываются одним воркером (VK_BOT_WORKERS)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': env.db('DATABASE_URL'),
 }
 
 # Password validation
@@ -117,6 +139,48 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 MEDIA_URL = '/media/'
 
+# токены проверяются при создании клиентов Вк (vk_bot.core.clients), команды без Вк работают и без них
 VK_BOT_TOKEN = env('VK_BOT_TOKEN')
 VK_STANDALONE_APP_ID = env('VK_STANDALONE_APP_ID')
 VK_STANDALONE_APP_TOKEN = env('VK_STANDALONE_APP_TOKEN')
+
+# количество воркеров обработки событий и размер очереди каждого воркера
+VK_BOT_WORKERS = env('VK_BOT_WORKERS')
+VK_BOT_QUEUE_SIZE = env('VK_BOT_QUEUE_SIZE')
+
+# Callback API: строка подтверждения сервера и секретный ключ из настроек сообщества
+VK_CALLBACK_CONFIRMATION_CODE = env('VK_CALLBACK_CONFIRMATION_CODE')
+VK_CALLBACK_SECRET = env('VK_CALLBACK_SECRET')
+
+# лимиты запросов к Вк в секунду для токена сообщества и токена standalone приложения
+VK_BOT_RPS = env('VK_BOT_RPS')
+VK_STANDALONE_RPS = env('VK_STANDALONE_RPS')
+
+# кэш пользователей: максимальное количество записей и время жизни имени в секундах
+VK_USERS_CACHE_SIZE = env('VK_USERS_CACHE_SIZE')
+VK_USERS_CACHE_TTL = env('VK_USERS_CACHE_TTL')
+
+# хранилище следующих шагов пользователей: memory, db или redis; время жизни шага в секундах
+VK_BOT_STATE_BACKEND = env('VK_BOT_STATE_BACKEND')
+VK_BOT_STATE_TTL = env('VK_BOT_STATE_TTL')
+VK_BOT_STATE_REDIS_URL = env('VK_BOT_STATE_REDIS_URL')
+
+# очередь фоновых задач (импорт альбомов, приглашения): memory или db; количество воркеров
+VK_BOT_JOBS_BACKEND = env('VK_BOT_JOBS_BACKEND')
+VK_BOT_JOB_WORKERS = env('VK_BOT_JOB_WORKERS')
+
+# метрики в формате Prometheus: порт HTTP сервера (0 - не запускать) и/или файл, в который они записываются
+VK_BOT_METRICS_PORT = env('VK_BOT_METRICS_PORT')
+VK_BOT_METRICS_TEXTFILE = env('VK_BOT_METRICS_TEXTFILE')
+
+# бюджет запросов к БД на событие и повторов одного запроса (0 - без ограничения);
+# при превышении warn пишет предупреждение, raise выбрасывает исключение (для тестов)
+VK_BOT_QUERY_BUDGET = env('VK_BOT_QUERY_BUDGET')
+VK_BOT_DUPLICATE_QUERY_BUDGET = env('VK_BOT_DUPLICATE_QUERY_BUDGET')
+VK_BOT_QUERY_BUDGET_MODE = env('VK_BOT_QUERY_BUDGET_MODE')
+
+# логирование: формат text или json; размер очереди записей, которые выводятся в отдельном потоке
+# (0 - выводить сразу); не больше LOG_SAMPLING_RATE записей ниже WARNING в секунду с одной строки кода (0 - все)
+LOG_FORMAT = env('LOG_FORMAT')
+LOG_QUEUE_SIZE = env('LOG_QUEUE_SIZE')
+LOG_SAMPLING_RATE = env('LOG_SAMPLING_RATE')
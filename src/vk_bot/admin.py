@@ -32,3 +32,18 @@ class GameAdmin(admin.ModelAdmin):
 class ImageWordAdmin(admin.ModelAdmin):
     list_display = ('id', 'image', 'name')
     ordering = ['-update_date']
+
+
+@admin.register(models.NextStepState)
+class NextStepStateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'name', 'expires')
+    search_fields = ('chat_id',)
+    ordering = ['-update_date']
+
+
+@admin.register(models.BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'name', 'status')
+    list_filter = ('status',)
+    search_fields = ('chat_id',)
+    ordering = ['-update_date']
@@ -0,0 +1,178 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.db import close_old_connections
+
+from config.logger import logger
+from vk_bot.core import metrics
+from vk_bot.core.dispatcher import get_workers_count
+from vk_bot.core.outbound import send_request
+from vk_bot.core.ratelimit import PRIORITY_NORMAL
+
+# паузы перед повторным подключением к long poll серверу после ошибки, секунды
+LONG_POLL_RETRY_DELAYS = (1, 2, 5, 10, 30)
+
+
+class AsyncBotRuntime:
+    """
+    Асинхронный режим работы бота в одном процессе.
+
+    Получение событий, обработка и отправка сообщений выполняются задачами asyncio:
+    - long poll опрашивается в пуле потоков и складывает события в ограниченную очередь;
+    - обработчики событий (логика VkBot и GameProcess, работа с БД) выполняются в отдельном пуле из handlers потоков,
+      события одного пользователя и игроков одной игры обрабатываются строго по порядку
+      (с SQLite обработчик один, см. get_workers_count);
+    - исходящие сообщения не ждут ответа Вк: одновременно выполняется не больше senders запросов,
+      запрос уходит только после предыдущих запросов всем своим получателям, поэтому сообщения
+      одному пользователю (в том числе в пачках нескольким пользователям) приходят по порядку.
+    """
+
+    def __init__(self, bot, handlers: int = 4, senders: int = 4, queue_size: int = 1000, http_threads: int = 8):
+        self.bot = bot
+        self.handlers = handlers
+        self.senders = senders
+        self.queue_size = queue_size
+        self.http_threads = http_threads
+
+        self.loop = None
+        self.executor = None
+        self.handlers_executor = None
+        self.events = None
+        self.outbound_slots = None
+        self.senders_semaphore = None
+        # получатель: последняя задача отправки запроса с его участием
+        self.recipient_tasks: {str: asyncio.Task} = {}
+        self.pending_requests = 0
+        # ключ (пользователь или игра): последняя задача обработки события с этим ключом
+        self.key_tasks: {tuple: asyncio.Task} = {}
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(self.http_threads, thread_name_prefix='vk-http')
+        self.handlers = get_workers_count(self.handlers)
+        self.handlers_executor = ThreadPoolExecutor(self.handlers, thread_name_prefix='vk-handler')
+        self.events = asyncio.Queue(maxsize=self.queue_size)
+        self.outbound_slots = asyncio.Semaphore(self.queue_size)
+        self.senders_semaphore = asyncio.Semaphore(self.senders)
+        self.bot.message_sender = self.send_threadsafe
+        self.bot.event_submitter = self.submit_threadsafe
+        metrics.queue_size.set_function('async_runtime', self.get_queue_sizes)
+
+        logger.info('Вк бот запущен в асинхронном режиме...')
+        tasks = [asyncio.create_task(self.fetch_events()), asyncio.create_task(self.process_events())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.bot.message_sender = None
+            self.bot.event_submitter = None
+            self.executor.shutdown(wait=False)
+            self.handlers_executor.shutdown(wait=False)
+
+    def get_queue_sizes(self) -> dict:
+        return {('events',): self.events.qsize(), ('outbound',): self.pending_requests}
+
+    async def fetch_events(self):
+        """
+        Получение событий от Вк.
+        После ошибки запроса получение повторяется с нарастающей паузой и переподключением к long poll серверу.
+        """
+        errors_count = 0
+        while True:
+            try:
+                if errors_count:
+                    await self.loop.run_in_executor(self.executor, self.bot.long_poll.update_longpoll_server)
+                events = await self.loop.run_in_executor(self.executor, self.bot.long_poll.check)
+            except Exception:
+                delay = LONG_POLL_RETRY_DELAYS[min(errors_count, len(LONG_POLL_RETRY_DELAYS) - 1)]
+                errors_count += 1
+                logger.exception(f'Ошибка получения событий от Вк, повтор через {delay} с')
+                await asyncio.sleep(delay)
+                continue
+            errors_count = 0
+            for event in events:
+                if event.to_me:
+                    await self.events.put(event)
+
+    async def process_events(self):
+        """
+        Запуск обработки событий. Одновременно обрабатывается не больше handlers событий.
+        """
+        semaphore = asyncio.Semaphore(self.handlers)
+        while True:
+            event = await self.events.get()
+            await semaphore.acquire()
+
+            keys = {('user', event.user_id), self.bot.get_event_key(event)}
+            previous_tasks = [self.key_tasks[key] for key in keys if key in self.key_tasks]
+            task = asyncio.create_task(self.handle_event(event, previous_tasks))
+            for key in keys:
+                self.key_tasks[key] = task
+            task.add_done_callback(lambda done_task, task_keys=keys: self._task_done(task_keys, done_task))
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def handle_event(self, event, previous_tasks: list):
+        if previous_tasks:
+            await asyncio.wait(previous_tasks)
+        await self.loop.run_in_executor(self.handlers_executor, self.run_handler, event)
+
+    def run_handler(self, event):
+        """
+        Обработка события в потоке пула. Соединение с БД потока закрывается, если оно разорвано
+        или истёк CONN_MAX_AGE, поэтому соединений к БД не больше, чем потоков обработчиков.
+        """
+        close_old_connections()
+        try:
+            self.bot.handle_event(event)
+        finally:
+            close_old_connections()
+
+    def _task_done(self, keys: set, task):
+        for key in keys:
+            if self.key_tasks.get(key) is task:
+                del self.key_tasks[key]
+
+    def submit_threadsafe(self, event):
+        """
+        Постановка события (шага фоновой задачи) в очередь обработки из другого потока.
+        """
+        asyncio.run_coroutine_threadsafe(self.events.put(event), self.loop).result()
+
+    def send_threadsafe(self, method: str, values: dict, recipients: tuple = (), priority: int = PRIORITY_NORMAL):
+        """
+        Постановка запроса к Вк в очередь отправки из потока обработчика.
+        Запросы с общими получателями уходят по порядку. Блокирует поток, если в очереди queue_size запросов.
+        """
+        asyncio.run_coroutine_threadsafe(self.enqueue_request(method, values, recipients, priority),
+                                         self.loop).result()
+
+    async def enqueue_request(self, method: str, values: dict, recipients: tuple, priority: int):
+        await self.outbound_slots.acquire()
+        self.pending_requests += 1
+        recipients = {str(recipient) for recipient in recipients}
+        previous_tasks = {self.recipient_tasks[recipient] for recipient in recipients
+                          if recipient in self.recipient_tasks}
+        task = asyncio.create_task(self.send_request(method, values, priority, previous_tasks))
+        for recipient in recipients:
+            self.recipient_tasks[recipient] = task
+        task.add_done_callback(lambda done_task, task_recipients=recipients:
+                               self._request_done(task_recipients, done_task))
+
+    async def send_request(self, method: str, values: dict, priority: int, previous_tasks: set):
+        if previous_tasks:
+            await asyncio.wait(previous_tasks)
+        async with self.senders_semaphore:
+            try:
+                await self.loop.run_in_executor(
+                    self.executor, partial(send_request, self.bot.vk_bot, method, values, priority=priority))
+            except Exception:
+                logger.exception(f'Не удалось выполнить {method}')
+
+    def _request_done(self, recipients: set, task):
+        for recipient in recipients:
+            if self.recipient_tasks.get(recipient) is task:
+                del self.recipient_tasks[recipient]
+        self.pending_requests -= 1
+        self.outbound_slots.release()
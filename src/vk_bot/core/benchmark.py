@@ -0,0 +1,51 @@
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database(concurrent: bool = False):
+    """
+    Временная БД с применёнными миграциями (как при запуске тестов), рабочая БД не затрагивается.
+    concurrent - БД используется из нескольких потоков: SQLite создаётся в файле, а не в общей памяти,
+    где одновременная запись из разных соединений сразу завершается ошибкой блокировки.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if concurrent and connection.vendor == 'sqlite' and not old_test_name:
+        test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'vk_bot_benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+
+
+def measure(func, repeat: int = 1000) -> dict:
+    """
+    Время выполнения func в миллисекундах: среднее, медиана и 99 перцентиль.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return get_timings_stats(timings)
+
+
+def get_timings_stats(timings: list) -> dict:
+    timings = sorted(timings)
+    return {
+        'avg': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+def format_stats(stats: dict) -> str:
+    return f'avg {stats["avg"]:.3f} мс, p50 {stats["p50"]:.3f} мс, p99 {stats["p99"]:.3f} мс'
@@ -2,46 +2,97 @@ import random
 import time
 import traceback
 from datetime import datetime
+from functools import cached_property
+from typing import Union
 
-import vk_api
-from vk_api import VkUpload
-from vk_api.keyboard import VkKeyboard
-from vk_api.longpoll import VkLongPoll, VkEventType, Event
+from django.db import transaction
 
-from config.logger import logger
-from config.settings import VK_BOT_TOKEN, VK_STANDALONE_APP_ID, VK_STANDALONE_APP_TOKEN
-from vk_bot.core import keyboards
+from vk_api import VkApi, VkUpload
+from vk_api.keyboard import VkKeyboard
+from vk_api.exceptions import ApiError
+from vk_api.longpoll import VkEventType, Event
+
+from config.logger import logger, logging_context
+from config.settings import VK_BOT_WORKERS, VK_BOT_QUEUE_SIZE, VK_USERS_CACHE_SIZE, VK_USERS_CACHE_TTL, \
+    VK_BOT_STATE_BACKEND, VK_BOT_STATE_TTL, VK_BOT_STATE_REDIS_URL, VK_BOT_JOBS_BACKEND, VK_BOT_JOB_WORKERS, \
+    VK_BOT_QUERY_BUDGET, VK_BOT_DUPLICATE_QUERY_BUDGET, VK_BOT_QUERY_BUDGET_MODE
+from vk_bot.core import keyboards, metrics
+from vk_bot.core.clients import VkClientFactory
+from vk_bot.core.deck import collection_snapshots
+from vk_bot.core.dispatcher import EventDispatcher, get_workers_count
+from vk_bot.core.game_state import load_game_state
+from vk_bot.core.importer import iter_album_images, sync_album_images, parse_album_url
+from vk_bot.core.jobs import Job, JobCancelled, JobStepEvent, get_job_queue
+from vk_bot.core.outbound import OutboundQueue, send_request
+from vk_bot.core.profiler import EventProfiler
+from vk_bot.core.scoring import score_host_round
+from vk_bot.core.router import CommandRouter
+from vk_bot.core.ratelimit import PRIORITY_NORMAL, PRIORITY_LOW, RETRY_ERROR_CODES
+from vk_bot.core.state import NextStep, get_state_store
+from vk_bot.core.users import UserCache, UserNamesRefresher
 from vk_bot import models
-from vk_bot.core.game import GameProcess, clear_user_game_data, end_game, get_game_results_table
-
-if not VK_BOT_TOKEN:
-    raise ValueError('VK_TOKEN не может быть пустым')
-
-if not VK_STANDALONE_APP_ID:
-    raise ValueError('VK_STANDALONE_APP_ID не может быть пустым')
-
-if not VK_STANDALONE_APP_TOKEN:
-    raise ValueError('VK_STANDALONE_APP_TOKEN не может быть пустым')
-
+from vk_bot.core.game import GameProcess, clear_user_game_data, end_game, get_game_results_table, \
+    claim_game_transition, save_game, save_user
 
-class NextStep:
-    def __init__(self, callback, *args, **kwargs):
-        self.callback = callback
-        self.args = args
-        self.kwargs = kwargs
+# команды бота, обработчики регистрируются декораторами методов VkBot
+router = CommandRouter()
 
 
 class VkBot:
-    def __init__(self, token):
-        self.vk_bot = vk_api.VkApi(token=token)
-        self.vk_standalone = vk_api.VkApi(app_id=VK_STANDALONE_APP_ID, token=VK_STANDALONE_APP_TOKEN)
-        self.long_poll = VkLongPoll(self.vk_bot)
-        self.upload = VkUpload(self.vk_bot)
-        self.next_step_users: {str: NextStep} = {}
+    def __init__(self, client_factory: VkClientFactory = None):
+        """
+        Клиенты Вк создаются фабрикой при первом обращении
+        (например, FakeVkClientFactory для бенчмарков), создание бота не обращается к Вк.
+        """
+        self.client_factory = client_factory or VkClientFactory()
+        self.next_steps = get_state_store(VK_BOT_STATE_BACKEND, ttl=VK_BOT_STATE_TTL, redis_url=VK_BOT_STATE_REDIS_URL)
+        # игра, в которой пользователь находился при обработке последнего события
+        self.user_game_ids: {int: int} = {}
+        # функция отправки запросов без ожидания ответа (используется асинхронным режимом)
+        self.message_sender = None
+        # функция передачи события обработчикам (устанавливается режимом запуска), см. submit_job_step
+        self.event_submitter = None
+        self.outbound = OutboundQueue(self.post)
+        self.users_cache = UserCache(max_size=VK_USERS_CACHE_SIZE, ttl=VK_USERS_CACHE_TTL)
+        self.jobs = get_job_queue(VK_BOT_JOBS_BACKEND, runner=self.run_job, workers=VK_BOT_JOB_WORKERS,
+                                  notify=self.send_job_progress)
+        self.profiler = EventProfiler(query_budget=VK_BOT_QUERY_BUDGET, duplicate_budget=VK_BOT_DUPLICATE_QUERY_BUDGET,
+                                      mode=VK_BOT_QUERY_BUDGET_MODE)
+
+    @cached_property
+    def vk_bot(self) -> VkApi:
+        return self.client_factory.create_bot_api()
+
+    @cached_property
+    def vk_standalone(self) -> VkApi:
+        return self.client_factory.create_standalone_api()
+
+    @cached_property
+    def long_poll(self):
+        return self.client_factory.create_long_poll(self.vk_bot)
+
+    @cached_property
+    def upload(self) -> VkUpload:
+        return self.client_factory.create_upload(self.vk_bot)
+
+    @cached_property
+    def user_names_refresher(self) -> UserNamesRefresher:
+        return UserNamesRefresher(self.vk_bot, self.users_cache)
+
+    def connect(self):
+        """
+        Создание клиентов Вк перед запуском: ошибки настроек и подключения видны сразу,
+        а не повторяются в цикле infinity_polling.
+        """
+        for client in ('vk_bot', 'vk_standalone', 'long_poll'):
+            getattr(self, client)
 
-    def send_message(self, user_id: str, text, keyboard: VkKeyboard = None, photo_attachments: list = None):
+    def send_message(self, user_id: str, text, keyboard: Union[VkKeyboard, str] = None,
+                     photo_attachments: list = None, priority: int = PRIORITY_NORMAL):
         """
         Отправка сообщения пользователю.
+        keyboard - готовый JSON клавиатуры из keyboards или VkKeyboard.
+        priority - приоритет отправки при нехватке лимита запросов к Вк.
         """
 
         values = {
@@ -50,12 +101,24 @@ class VkBot:
             'random_id': int(datetime.now().strftime('%y%m%d%H%S%f'))
         }
 
-        if keyboard:
-            values['keyboard'] = keyboard.get_keyboard(),
+        if isinstance(keyboard, VkKeyboard):
+            values['keyboard'] = keyboard.get_keyboard()
+        elif keyboard:
+            values['keyboard'] = keyboard
 
         if photo_attachments:
             values['attachment'] = ','.join(photo_attachments)
-        self.vk_bot.method('messages.send', values)
+        self.outbound.send(values, priority)
+
+    def post(self, method: str, values: dict, recipients: tuple = (), priority: int = PRIORITY_NORMAL):
+        """
+        Вызов метода Вк, результат которого не нужен обработчику.
+        recipients - id получателей строками, по ним упорядочиваются запросы в асинхронном режиме.
+        """
+        if self.message_sender:
+            self.message_sender(method, values, recipients, priority)
+        else:
+            send_request(self.vk_bot, method, values, priority=priority)
 
     def upload_photos(self, photo) -> list:
         response = self.upload.photo_messages(photo)
@@ -69,21 +132,93 @@ class VkBot:
             attachments = attachments[:-1]
         return attachments
 
-    def polling(self):
+    def polling(self, workers: int = VK_BOT_WORKERS, queue_size: int = VK_BOT_QUEUE_SIZE):
         """
         Получение обновлений от Вк.
+        При workers > 1 события обрабатываются параллельно, с сохранением порядка для каждого пользователя
+        (кроме SQLite, см. get_workers_count).
         :return:
         """
-        logger.info('Вк бот запущен...')
-        for event in self.long_poll.listen():
-            event: Event
+        workers = get_workers_count(workers)
+        logger.info(f'Вк бот запущен (воркеров: {workers})...')
+        # даже с одним воркером события обрабатываются не в потоке long poll: туда же приходят шаги фоновых задач
+        dispatcher = EventDispatcher(self.handle_event, workers=workers, queue_size=queue_size,
+                                     get_key=self.get_event_key)
+        metrics.queue_size.set_function('dispatcher', lambda: {
+            (f'dispatcher_{i}',): size for i, size in enumerate(dispatcher.queue_sizes())
+        })
+        dispatcher.start()
+        self.event_submitter = dispatcher.submit
+        try:
+            for event in self.long_poll.listen():
+                event: Event
+                if event.to_me:
+                    dispatcher.submit(event)
+        finally:
+            self.event_submitter = None
+            dispatcher.stop()
+
+    def handle_event(self, event):
+        """
+        Обработка события с уведомлением пользователя об ошибке.
+        """
+        metrics.events_total.inc(getattr(event.type, 'name', event.type))
+        # превышение бюджета запросов в режиме raise выходит за пределы обработки ошибок
+        with self.profiler.profile():
             try:
                 self.event_handling(event)
+            except ApiError as e:
+                logger.error(traceback.format_exc())
+                # при превышении лимита запросов сообщение об ошибке только усилит нагрузку
+                if e.code not in RETRY_ERROR_CODES:
+                    self.send_error_message(event.user_id)
             except:
                 logger.error(traceback.format_exc())
-                self.send_message(user_id=event.user_id, text='Что-то пошло не так 😞\n\n'
-                                                              'Попробуйте позже или перезапустите бота командой "Старт"️\n'
-                                                              'Мы уже работает над исправлением проблемы ⚙️')
+                self.send_error_message(event.user_id)
+
+    def send_error_message(self, user_id):
+        try:
+            self.send_message(user_id=user_id, text='Что-то пошло не так 😞\n\n'
+                                                    'Попробуйте позже или перезапустите бота командой "Старт"️\n'
+                                                    'Мы уже работает над исправлением проблемы ⚙️',
+                              priority=PRIORITY_LOW)
+        except:
+            logger.error(traceback.format_exc())
+
+    def run_job(self, job: Job):
+        """
+        Выполнение фоновой задачи: job.name - имя метода бота, который принимает задачу и её аргументы.
+        """
+        try:
+            getattr(self, job.name)(job, *job.args, **job.kwargs)
+        except JobCancelled:
+            raise
+        except Exception:
+            self.send_error_message(job.user_id)
+            raise
+
+    def submit_job_step(self, job: Job, name: str, *args):
+        """
+        Передача продолжения задачи обработчикам событий пользователя (см. JobStepEvent).
+        Без запущенного приёма событий (тесты, бенчмарки) шаг выполняется сразу.
+        """
+        event = JobStepEvent(job.user_id, name, args)
+        if self.event_submitter:
+            self.event_submitter(event)
+        else:
+            self.handle_event(event)
+
+    def send_job_progress(self, user_id, text):
+        self.send_message(user_id=user_id, text=text, priority=PRIORITY_LOW)
+
+    def get_event_key(self, event):
+        """
+        Ключ распределения события по воркерам: события игроков одной игры обрабатываются одним воркером.
+        """
+        game_id = self.user_game_ids.get(event.user_id)
+        if game_id:
+            return 'game', game_id
+        return 'user', event.user_id
 
     def infinity_polling(self):
         """
@@ -102,21 +237,47 @@ class VkBot:
     def get_user(self, event) -> models.VkUser:
         """
         Получение или создание пользователя из базы данных.
+        Имя нового пользователя загружается из Вк сразу, после истечения срока кэша - в фоне.
         """
-        vk_user = self.vk_bot.method("users.get", {"user_ids": event.user_id})
-        fullname = vk_user[0]['first_name'] + ' ' + vk_user[0]['last_name']
-        try:
-            user_object = models.VkUser.objects.get(chat_id=event.user_id)
-        except models.VkUser.DoesNotExist:
-            user_object = models.VkUser.objects.create(chat_id=event.user_id, name=fullname)
+        chat_id = event.user_id
+        cached_user = self.users_cache.get(chat_id)
+        if cached_user:
+            try:
+                user_object = models.VkUser.objects.get(id=cached_user.id)
+            except models.VkUser.DoesNotExist:
+                self.users_cache.delete(chat_id)
+            else:
+                if cached_user.name and user_object.name != cached_user.name:
+                    # имя обновилось в фоне (UserNamesRefresher обновляет только кэш)
+                    user_object.name = cached_user.name
+                    save_user(user_object, 'name')
+                if cached_user.expires < time.monotonic():
+                    self.users_cache.set(chat_id, user_object.id, user_object.name)
+                    self.user_names_refresher.schedule(chat_id)
+                return user_object
+
+        user_object = models.VkUser.objects.get_or_create(chat_id=chat_id)[0]
+        if not user_object.name:
+            # имя нового пользователя нужно сразу: оно попадает в сообщения другим игрокам
+            try:
+                user_object.name = self.user_names_refresher.fetch_name(chat_id)
+            except Exception:
+                logger.error(traceback.format_exc())
+            if user_object.name:
+                save_user(user_object, 'name')
+        self.users_cache.set(chat_id, user_object.id, user_object.name)
+        if not user_object.name:
+            self.user_names_refresher.schedule(chat_id)
         return user_object
 
     def register_next_step_by_user_id(self, user_id, callback, *args, **kwargs):
         """
         Регистрация функции, которая обработает слдующий ивент по user_id.
+        callback - метод бота, аргументы должны сериализоваться в JSON.
         """
-        next_step = NextStep(callback, *args, **kwargs)
-        self.next_step_users[user_id] = next_step
+        if getattr(callback, '__self__', None) is not self:
+            raise ValueError('Следующим шагом может быть только метод бота')
+        self.next_steps.set(user_id, NextStep(name=callback.__name__, args=list(args), kwargs=kwargs))
 
     def register_next_step(self, event, callback, *args, **kwargs):
         """
@@ -129,135 +290,180 @@ class VkBot:
         """
         Обработка запланированных ивентов
         """
-        user_id = event.user_id
-        if self.next_step_users.get(user_id):
-            next_step = self.next_step_users[user_id]
-            del self.next_step_users[user_id]
-            next_step.callback(event, user, *next_step.args, **next_step.kwargs)
+        next_step = self.next_steps.pop(event.user_id)
+        if next_step:
+            self.profiler.set_label(f'next_step:{next_step.name}')
+            callback = getattr(self, next_step.name)
+            callback(event, user, *next_step.args, **next_step.kwargs)
             return True
 
+    @metrics.handler_seconds.timed('event_handling')
     def event_handling(self, event):
         """
         Обработка событий бота.
         """
+        if isinstance(event, JobStepEvent):
+            self.profiler.set_label(f'job_step:{event.name}')
+            with logging_context(user=str(event.user_id), job=event.name):
+                getattr(self, event.name)(event, *event.args, **event.kwargs)
+            return
+
         if event.to_me:
             user = self.get_user(event)
-            logger.info(f'New event [user: {user}, type: {event.type}]: "{event.text}"')
-            if self.processing_next_step(event, user):
-                return
-            elif event.type == VkEventType.MESSAGE_NEW:
-                self.message_processing(event, user)
+            label = self.get_event_label(user)
+            self.profiler.set_label(label)
+            # записи лога при обработке события помечаются пользователем, игрой и этапом
+            with logging_context(user=user.chat_id, game=user.current_game_id, stage=label):
+                logger.info('New event [user: %s, type: %s]: "%s"', user, event.type, event.text)
+                try:
+                    if self.processing_next_step(event, user):
+                        return
+                    elif event.type == VkEventType.MESSAGE_NEW:
+                        self.message_processing(event, user)
+                finally:
+                    self.remember_user_game(event.user_id, user.current_game_id)
+
+    def get_event_label(self, user: models.VkUser) -> str:
+        """
+        Метка обработчика события для профилирования: этап текущей игры или меню.
+        """
+        game = user.current_game
+        if game and game.status != 'creating':
+            return f'game:{game.stage}'
+        return 'menu'
+
+    def remember_user_game(self, user_id, game_id):
+        if game_id:
+            self.user_game_ids[user_id] = game_id
+        else:
+            self.user_game_ids.pop(user_id, None)
 
+    @metrics.handler_seconds.timed('message_processing')
     def message_processing(self, event, user: models.VkUser):
         """
         Обработка текстовых сообщений.
         """
-
-        event_text = event.text
-
-        if event_text.lower() in ['начать', 'start']:
-            clear_user_game_data(user=user)
-            collection = models.Collection.objects.filter(standard=True).first()
-            if not collection:
-                self.send_message(user_id=user.chat_id, text='Чат бот в разработке 😉')
-
-            user.current_game = models.Game.objects.create(single=True, status='creating', stage='getting_answers',
-                                                           creator=user)
-            self.start_single_game(user=user, collection=collection, start_text='Привет!\n'
-                                                                                'Добро пожаловть в чат бота с игрой "Имаджинариум"\n\n'
-                                                                                'Задача игры - угадать какую картинку я загадал\n'
-                                                                                'Укажите номер изображения на котором изображено слово '
-                                                                                '(номера считаются с лева на право)\n\n'
-                                                                                'Игра завершится, когда в колоде закончатся карты')
+        handler = router.resolve(event.text, state='any')
+        if handler:
+            handler(self, event, user)
             return
 
         current_game = user.current_game
         if current_game and current_game.status != 'creating':
-            self.game_execution(user=user, game=current_game, event_text=event_text)
+            self.game_execution(user=user, game=current_game, event_text=event.text)
             return
 
-        if event_text.lower() == 'одиночная игра':
-            user.current_game = models.Game.objects.create(single=True, status='creating', stage='getting_answers',
-                                                           creator=user)
-            user.save()
-            self.send_message(user_id=user.chat_id,
-                              text='Выберите коллекцию изображений',
-                              keyboard=keyboards.get_select_collection_keyboard())
-
-        elif event_text.lower() == 'мультиплеер':
-            self.send_message(user_id=user.chat_id,
-                              text='Мультиплеер',
-                              keyboard=keyboards.get_multiplayer_keyboard())
-
-        elif event_text.lower() == 'найти игру':
-            games = models.Game.objects.filter(status__in=['waiting', 'started'], single=False)[:5]
-
-            if not games:
-                self.send_message(user_id=user.chat_id,
-                                  text=f'Сейчас нет активных игр 💁‍♂️\n'
-                                       f'Создайте свою 😉')
-
-            for game in games:
-                self.send_message(user_id=user.chat_id,
-                                  text=f'Игра #{game.id}\n'
-                                       f'Статус: {game.status}\n'
-                                       f'Игроки: {game.users.count()}',
-                                  keyboard=keyboards.get_connect_to_game_keyboard(game.id))
-        elif 'подключиться к игре ' in event_text.lower():
-            try:
-                game_id = int(event_text.split('#')[-1])
-            except:
-                self.send_message(user_id=user.chat_id,
-                                  text=f'Не удалось распознать игру',
-                                  keyboard=keyboards.get_main_menu_keyboard())
-                return
-
-            game = models.Game.objects.filter(id=game_id, status__in=['waiting', 'started'], single=False).first()
-            if not game:
-                self.send_message(user_id=user.chat_id,
-                                  text=f'Похоже игра к которой вы пытаетесь подключиться, уже завершилась',
-                                  keyboard=keyboards.get_multiplayer_keyboard())
-                return
-
-            self.connect_to_game(user=user, game=game)
+        handler = router.resolve(event.text, state='menu')
+        if handler:
+            handler(self, event, user)
+        else:
+            self.send_not_understand_message(user)
 
-        elif event_text.lower() == 'создать игру':
-            user.current_game = models.Game.objects.create(single=False, status='creating', stage='getting_answers',
-                                                           creator=user)
-            user.save()
+    @router.command('начать', 'start', state='any')
+    def start_command(self, event, user: models.VkUser):
+        clear_user_game_data(user=user)
+        collection = models.Collection.objects.filter(standard=True).first()
+        if not collection:
+            self.send_message(user_id=user.chat_id, text='Чат бот в разработке 😉')
+
+        user.current_game = models.Game.objects.create(single=True, status='creating', stage='getting_answers',
+                                                       creator=user)
+        self.start_single_game(user=user, collection=collection, start_text='Привет!\n'
+                                                                            'Добро пожаловть в чат бота с игрой "Имаджинариум"\n\n'
+                                                                            'Задача игры - угадать какую картинку я загадал\n'
+                                                                            'Укажите номер изображения на котором изображено слово '
+                                                                            '(номера считаются с лева на право)\n\n'
+                                                                            'Игра завершится, когда в колоде закончатся карты')
+
+    @router.command('одиночная игра', state='menu')
+    def single_game_command(self, event, user: models.VkUser):
+        user.current_game = models.Game.objects.create(single=True, status='creating', stage='getting_answers',
+                                                       creator=user)
+        save_user(user, 'current_game')
+        self.send_message(user_id=user.chat_id,
+                          text='Выберите коллекцию изображений',
+                          keyboard=keyboards.get_select_collection_keyboard())
+
+    @router.command('мультиплеер', state='menu')
+    def multiplayer_command(self, event, user: models.VkUser):
+        self.send_message(user_id=user.chat_id,
+                          text='Мультиплеер',
+                          keyboard=keyboards.get_multiplayer_keyboard())
+
+    @router.command('найти игру', state='menu')
+    def find_game_command(self, event, user: models.VkUser):
+        games = models.Game.objects.filter(status__in=['waiting', 'started'], single=False)[:5]
+
+        if not games:
             self.send_message(user_id=user.chat_id,
-                              text='Выберите коллекцию изображений',
-                              keyboard=keyboards.get_select_collection_keyboard())
+                              text=f'Сейчас нет активных игр 💁‍♂️\n'
+                                   f'Создайте свою 😉')
 
-        elif event_text.lower() == 'создать игру с ведущим':
-            user.current_game = models.Game.objects.create(single=False, with_host=True, status='creating',
-                                                           stage='getting_answers',
-                                                           creator=user)
-            user.save()
+        for game in games:
             self.send_message(user_id=user.chat_id,
-                              text='Выберите коллекцию изображений',
-                              keyboard=keyboards.get_select_collection_keyboard())
-
-        elif event_text.lower() == 'стандартная':
-            collection = models.Collection.objects.filter(standard=True).first()
-            if user.current_game.single:
-                self.start_single_game(user, collection=collection)
-            else:
-                self.start_multiplayer_game(user, collection=collection)
+                              text=f'Игра #{game.id}\n'
+                                   f'Статус: {game.status}\n'
+                                   f'Игроки: {game.users.count()}',
+                              keyboard=keyboards.get_connect_to_game_keyboard(game.id))
 
-        elif event_text.lower() == 'загрузить свою':
+    @router.prefix('подключиться к игре ', state='menu')
+    def connect_to_game_command(self, event, user: models.VkUser):
+        try:
+            game_id = int(event.text.split('#')[-1])
+        except:
             self.send_message(user_id=user.chat_id,
-                              text='Отправьте ссылку на альбом с изображениями', keyboard=keyboards.get_back_keyboard())
-            self.register_next_step(event, self.choosing_collection_by_url_step)
+                              text=f'Не удалось распознать игру',
+                              keyboard=keyboards.get_main_menu_keyboard())
+            return
 
-        elif event_text.lower() == 'основное меню':
-            clear_user_game_data(user=user)
+        game = models.Game.objects.filter(id=game_id, status__in=['waiting', 'started'], single=False).first()
+        if not game:
             self.send_message(user_id=user.chat_id,
-                              text='Основное меню',
-                              keyboard=keyboards.get_main_menu_keyboard())
+                              text=f'Похоже игра к которой вы пытаетесь подключиться, уже завершилась',
+                              keyboard=keyboards.get_multiplayer_keyboard())
+            return
 
+        self.connect_to_game(user=user, game=game)
+
+    @router.command('создать игру', state='menu')
+    def create_game_command(self, event, user: models.VkUser):
+        user.current_game = models.Game.objects.create(single=False, status='creating', stage='getting_answers',
+                                                       creator=user)
+        save_user(user, 'current_game')
+        self.send_message(user_id=user.chat_id,
+                          text='Выберите коллекцию изображений',
+                          keyboard=keyboards.get_select_collection_keyboard())
+
+    @router.command('создать игру с ведущим', state='menu')
+    def create_game_with_host_command(self, event, user: models.VkUser):
+        user.current_game = models.Game.objects.create(single=False, with_host=True, status='creating',
+                                                       stage='getting_answers',
+                                                       creator=user)
+        save_user(user, 'current_game')
+        self.send_message(user_id=user.chat_id,
+                          text='Выберите коллекцию изображений',
+                          keyboard=keyboards.get_select_collection_keyboard())
+
+    @router.command('стандартная', state='menu')
+    def standard_collection_command(self, event, user: models.VkUser):
+        collection = models.Collection.objects.filter(standard=True).first()
+        if user.current_game.single:
+            self.start_single_game(user, collection=collection)
         else:
-            self.send_not_understand_message(user)
+            self.start_multiplayer_game(user, collection=collection)
+
+    @router.command('загрузить свою', state='menu')
+    def custom_collection_command(self, event, user: models.VkUser):
+        self.send_message(user_id=user.chat_id,
+                          text='Отправьте ссылку на альбом с изображениями', keyboard=keyboards.get_back_keyboard())
+        self.register_next_step(event, self.choosing_collection_by_url_step)
+
+    @router.command('основное меню', state='menu')
+    def main_menu_command(self, event, user: models.VkUser):
+        clear_user_game_data(user=user)
+        self.send_message(user_id=user.chat_id,
+                          text='Основное меню',
+                          keyboard=keyboards.get_main_menu_keyboard())
 
     def send_in_development_message(self, user):
         self.send_message(user_id=user.chat_id, text=f'Этот раздел находится в разработке 🔧')
@@ -271,10 +477,10 @@ class VkBot:
         game = user.current_game
         game.collection = collection
         game.status = 'started'
-        game.save()
+        save_game(game, 'collection', 'status')
 
         user.current_score = 0
-        user.save()
+        save_user(user, 'current_game', 'current_score')
 
         game_process = GameProcess(game=game)
         game_circle = game_process.start_circle()
@@ -288,10 +494,10 @@ class VkBot:
         game = user.current_game
         game.collection = collection
         game.status = 'waiting'
-        game.save()
+        save_game(game, 'collection', 'status')
 
         user.current_score = 0
-        user.save()
+        save_user(user, 'current_game', 'current_score')
 
         self.send_message(user_id=user.chat_id, text='Всё готово 😎\n'
                                                      'Вы сможете начать игру, когда к ней кто-то подключится',
@@ -305,44 +511,23 @@ class VkBot:
             self.game_waiting(user=user, game=game, event_text=event_text)
             return
 
-        if game.single:
-            if event_text.lower() == 'результаты':
-                self.send_message(user_id=user.chat_id, text=f'Ваш счет в этой игре: {user.current_score} ✅',
-                                  keyboard=keyboards.get_next_circle_keyboard())
-                return
-            elif event_text.lower() == 'завершить игру':
-                self.send_message(user_id=user.chat_id, text=f'Игра звершена\n'
-                                                             f'Ваш счет: {user.current_score} ✅',
-                                  keyboard=keyboards.get_main_menu_keyboard())
-                end_game(game)
-                return
-        else:
-            if event_text.lower() == 'таблица результатов':
-                self.send_message(user_id=user.chat_id, text=get_game_results_table(game=game, user=user),
-                                  keyboard=keyboards.get_wait_circle_keyboard())
-                return
-            elif event_text.lower() == 'покинуть игру':
-                self.send_message(user_id=user.chat_id, text=f'Вы покинули игру\n\n'
-                                                             f'{get_game_results_table(game=game, user=user)}',
-                                  keyboard=keyboards.get_main_menu_keyboard())
-                if game.users.count() <= 1:
-                    end_game(game)
-                else:
-                    clear_user_game_data(user)
-                return
+        handler = router.resolve(event_text, state='single_game' if game.single else 'multiplayer_game')
+        if handler:
+            handler(self, user, game, event_text)
+            return
 
-            if game.users.count() <= 1:
-                self.send_message(user_id=user.chat_id, text=f'Игра завершена, так как все игроки вышли\n\n'
-                                                             f'{get_game_results_table(game=game, user=user)}',
-                                  keyboard=keyboards.get_main_menu_keyboard())
-                end_game(game)
-                return
+        if not game.single and game.users.count() <= 1:
+            self.send_message(user_id=user.chat_id, text=f'Игра завершена, так как все игроки вышли\n\n'
+                                                         f'{get_game_results_table(game=game, user=user)}',
+                              keyboard=keyboards.get_main_menu_keyboard())
+            end_game(game)
+            return
         # == игра с ведущим
         if game.stage == 'game_host_writing_word':
             if user.is_game_host:
                 try:
                     user.sent_card = user.cards_in_hand.all()[int(event_text) - 1]
-                    user.save()
+                    save_user(user, 'sent_card')
                 except:
                     photo_attachments = [image.attachment_data for image in user.cards_in_hand.all()]
                     self.send_message(user_id=user.chat_id,
@@ -354,7 +539,7 @@ class VkBot:
                                   text=f'Введите слово, которое обозначет то, что изображено на карте')
                 game.current_images.add(user.sent_card)
                 game.stage = 'sending_word'
-                game.save()
+                save_game(game, 'stage')
             else:
                 self.send_message(user_id=user.chat_id, text='Дождитесь пока ведущий загадает слово',
                                   keyboard=keyboards.get_wait_circle_keyboard())
@@ -369,15 +554,15 @@ class VkBot:
                                                              'Теперь дождитесь пока все сделают свой ход',
                                   keyboard=keyboards.get_wait_circle_keyboard())
 
-                for game_user in game.users.exclude(is_game_host=True):
-                    self.send_message(user_id=game_user.chat_id,
-                                      text=f'Ведущий загадал: {game.current_word}')
-                    photo_attachments = [image.attachment_data for image in game_user.cards_in_hand.all()]
-                    self.send_message(user_id=game_user.chat_id,
-                                      text='Отправьте карту, которая асоциируется у вас с этим словом',
-                                      keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
+                with self.outbound.batch():
+                    for player in load_game_state(game).get_not_hosts():
+                        self.send_message(user_id=player.user.chat_id,
+                                          text=f'Ведущий загадал: {game.current_word}')
+                        self.send_message(user_id=player.user.chat_id,
+                                          text='Отправьте карту, которая асоциируется у вас с этим словом',
+                                          keyboard=keyboards.get_answers_keyboard(count=len(player.hand)))
 
-                game.save()
+                save_game(game, 'stage', 'current_word')
             return
 
         elif game.stage == 'send_cards':
@@ -388,7 +573,7 @@ class VkBot:
             else:
                 try:
                     user.sent_card = user.cards_in_hand.all()[int(event_text) - 1]
-                    user.save()
+                    save_user(user, 'sent_card')
                 except:
                     photo_attachments = [image.attachment_data for image in user.cards_in_hand.all()]
                     self.send_message(user_id=user.chat_id,
@@ -397,34 +582,38 @@ class VkBot:
                                       keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
                     return
 
+                # игра не сохраняется целиком: устаревшая копия перезаписала бы версию, захваченную другим игроком
                 game.current_images.add(user.sent_card)
-                game.save()
 
                 self.send_message(user_id=user.chat_id, text='Отлично!\n'
                                                              'Теперь дождитесь пока все сделают свой ход',
                                   keyboard=keyboards.get_wait_circle_keyboard())
 
                 if game.current_images.count() - 1 >= game.users.filter(is_game_host=False).count():
-                    photo_attachments = [image.attachment_data for image in game.current_images.all()]
-                    random.shuffle(photo_attachments, random.random)
-                    game.current_attachment_data = photo_attachments
-
-                    for game_user in game.users.all():
-                        if game_user.is_game_host:
-                            # определяем каку юкарту загадали
-                            game.current_correct_answer = \
-                                photo_attachments.index(game_user.sent_card.attachment_data) + 1
-                            self.send_message(user_id=game_user.chat_id,
-                                              text=f'Полученный набор карт',
-                                              photo_attachments=photo_attachments,
-                                              keyboard=keyboards.get_wait_circle_keyboard())
-                        else:
-                            self.send_message(user_id=game_user.chat_id,
-                                              text=f'Отдагайте на какой карте изображено загаданное слово',
-                                              photo_attachments=photo_attachments,
-                                              keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
-                    game.stage = 'getting_answers'
-                    game.save()
+                    with self.outbound.batch(), transaction.atomic():
+                        if not claim_game_transition(game):
+                            return
+
+                        photo_attachments = [image.attachment_data for image in game.current_images.all()]
+                        random.shuffle(photo_attachments)
+                        game.current_attachment_data = photo_attachments
+
+                        for player in load_game_state(game).players:
+                            game_user = player.user
+                            if game_user.is_game_host:
+                                # определяем каку юкарту загадали
+                                game.current_correct_answer = photo_attachments.index(player.sent_card) + 1
+                                self.send_message(user_id=game_user.chat_id,
+                                                  text=f'Полученный набор карт',
+                                                  photo_attachments=photo_attachments,
+                                                  keyboard=keyboards.get_wait_circle_keyboard())
+                            else:
+                                self.send_message(user_id=game_user.chat_id,
+                                                  text=f'Отдагайте на какой карте изображено загаданное слово',
+                                                  photo_attachments=photo_attachments,
+                                                  keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
+                        game.stage = 'getting_answers'
+                        save_game(game, 'current_attachment_data', 'current_correct_answer', 'stage')
             return
 
         # ==
@@ -444,32 +633,74 @@ class VkBot:
             self.distribution_of_cards_in_game(game=game, users=[user])
             return
 
+    @router.command('результаты', state='single_game')
+    def single_game_results_command(self, user, game, event_text):
+        self.send_message(user_id=user.chat_id, text=f'Ваш счет в этой игре: {user.current_score} ✅',
+                          keyboard=keyboards.get_next_circle_keyboard())
+
+    @router.command('завершить игру', state='single_game')
+    def single_game_end_command(self, user, game, event_text):
+        self.send_message(user_id=user.chat_id, text=f'Игра звершена\n'
+                                                     f'Ваш счет: {user.current_score} ✅',
+                          keyboard=keyboards.get_main_menu_keyboard())
+        end_game(game)
+
+    @router.command('таблица результатов', state='multiplayer_game')
+    def game_results_table_command(self, user, game, event_text):
+        self.send_message(user_id=user.chat_id, text=get_game_results_table(game=game, user=user),
+                          keyboard=keyboards.get_wait_circle_keyboard())
+
+    @router.command('покинуть игру', state='multiplayer_game')
+    def leave_game_command(self, user, game, event_text):
+        self.send_message(user_id=user.chat_id, text=f'Вы покинули игру\n\n'
+                                                     f'{get_game_results_table(game=game, user=user)}',
+                          keyboard=keyboards.get_main_menu_keyboard())
+        if game.users.count() <= 1:
+            end_game(game)
+        else:
+            clear_user_game_data(user)
+
     def game_waiting(self, user, game, event_text):
         """
         Ожидание подключения игроков
         """
-        if event_text.lower() == 'покинуть игру':
-            self.send_message(user_id=user.chat_id, text=f'Вы покинули игру',
-                              keyboard=keyboards.get_main_menu_keyboard())
-            if game.users.count() <= 1:
-                end_game(game)
-            else:
-                clear_user_game_data(user)
-            return
+        handler = router.resolve(event_text, state='waiting_game')
+        if handler:
+            handler(self, user, game, event_text)
 
-        if 'vk.com' in event_text:
-            self.invite_person_by_link(game=game, user=user, inviting_person_url=event_text)
-            return
-        elif event_text.lower() == 'начать игру':
+    @router.command('покинуть игру', state='waiting_game')
+    def leave_waiting_game_command(self, user, game, event_text):
+        self.send_message(user_id=user.chat_id, text=f'Вы покинули игру',
+                          keyboard=keyboards.get_main_menu_keyboard())
+        if game.users.count() <= 1:
+            end_game(game)
+        else:
+            clear_user_game_data(user)
+
+    @router.regex(r'vk\.com', state='waiting_game')
+    def invite_person_command(self, user, game, event_text):
+        self.jobs.submit(user.chat_id, 'invite_person_job', game.id, event_text)
+
+    @router.command('начать игру', state='waiting_game')
+    def start_game_command(self, user, game, event_text):
+        with self.outbound.batch(), transaction.atomic():
+            # повторное нажатие или одновременный старт другим игроком не раздаёт карты второй раз
+            if not claim_game_transition(game):
+                return
             game.status = 'started'
-            game.save()
+            save_game(game, 'status')
             if game.with_host:
                 game_process = GameProcess(game=game)
                 game_process.init_game_with_host()
                 self.game_host_move(game=game, start_game=True)
             else:
-                self.distribution_of_cards_in_game(game=game, users=game.users.all(), next_circle_text='Игра началась!')
-            return
+                self.distribution_of_cards_in_game(game=game, users=game.users.all(),
+                                                   next_circle_text='Игра началась!')
+
+    def invite_person_job(self, job: Job, game_id: int, inviting_person_url: str):
+        game = models.Game.objects.get(id=game_id)
+        user = models.VkUser.objects.get(chat_id=job.user_id)
+        self.invite_person_by_link(game=game, user=user, inviting_person_url=inviting_person_url)
 
     def invite_person_by_link(self, game, user, inviting_person_url: str):
         """
@@ -478,7 +709,8 @@ class VkBot:
         try:
             inviting_person_username = \
                 inviting_person_url[inviting_person_url.find('vk.com/') + len('vk.com/'):].split('/')[0]
-            inviting_person_vk = self.vk_bot.method("users.get", {'user_ids': inviting_person_username})[0]
+            inviting_person_vk = self.vk_bot.method("users.get", {'user_ids': inviting_person_username},
+                                                    priority=PRIORITY_LOW)[0]
             inviting_person = models.VkUser.objects.get(chat_id=inviting_person_vk['id'])
         except:
             logger.error(traceback.format_exc())
@@ -494,11 +726,13 @@ class VkBot:
                           text=f'{user.name} приглашает вас на игру #{game.id}\n'
                                f'Статус: {game.status}\n'
                                f'Игроки: {game.users.count()}',
-                          keyboard=keyboards.get_connect_to_game_keyboard(game.id))
+                          keyboard=keyboards.get_connect_to_game_keyboard(game.id),
+                          priority=PRIORITY_LOW)
 
         self.send_message(user_id=user.chat_id, text=f'Приглашение отправлено пользователю '
                                                      f'{inviting_person.name}')
 
+    @metrics.handler_seconds.timed('getting_game_answers')
     def getting_game_answers(self, game, user, event_text):
         """
         Получение ответов
@@ -517,85 +751,45 @@ class VkBot:
 
             user.answer = user_answer
             user.answered = True
-            user.save()
+            save_user(user, 'answer', 'answered')
 
             self.send_message(user_id=user.chat_id, text='Прекрасно!\n'
                                                          'Осталось подождать, пока все дадут свой ответ')
 
             # если все дали свой ответ
             if game.users.filter(answered=True).count() >= game.users.exclude(is_game_host=True).count():
-                game_users = game.users.all()
-                game_current_attachment_data = game.current_attachment_data
-
-                host_card_answers_count = 0
-                users_card_answers = {}
-
-                for attachment_data, answer in zip(game_current_attachment_data,
-                                                   range(1, len(game_current_attachment_data) + 1)):
+                with self.outbound.batch(), transaction.atomic():
+                    # круг уже завершён обработчиком ответа другого игрока
+                    if not claim_game_transition(game):
+                        return
 
-                    image = models.Image.objects.get(attachment_data=attachment_data)
-                    image_user = game_users.get(sent_card=image)
-                    answers_count = game_users.exclude(is_game_host=True).filter(answer=answer).count()
+                    round_result = score_host_round(game)
+                    game_users = round_result.users
 
-                    if image_user.is_game_host:
-                        host_card_answers_count += answers_count
-                    else:
-                        if not users_card_answers.get(image_user):
-                            users_card_answers[image_user] = 0
-                        users_card_answers[image_user] += answers_count
+                    users_card_answers_table = ''
+                    for game_user, score in round_result.round_scores.items():
+                        users_card_answers_table += f'\n{game_user.name}: {score}'
 
-                if host_card_answers_count == 0 \
-                        or host_card_answers_count >= game_users.exclude(is_game_host=True).count():
-                    for game_user in game_users:
-                        if game_user.is_game_host:
-                            users_card_answers[game_user] = 0
-                            continue
-                        game_user.current_score += 2
-                        users_card_answers[game_user] = 2
-                        game_user.save()
-                else:
-                    for game_user in game_users:
-                        if game_user.is_game_host:
-                            game_user.current_score += 2
-                            users_card_answers[game_user] = 2
-                        else:
-                            game_user.current_score += users_card_answers[game_user]
-                        game_user.save()
-
-                users_card_answers_table = ''
-                for game_user, score in users_card_answers.items():
-                    users_card_answers_table += f'\n{game_user.name}: {score}'
-
-                won_user = None
-                for game_user in game_users:
-                    if game_user.current_score >= 40:
-                        won_user = game_user
-
-                    self.send_message(user_id=game_user.chat_id,
-                                      text=f'Баллы в этом круге:\n {users_card_answers_table}\n\n'
-                                           f'{get_game_results_table(game=game, user=game_user)}\n\n'
-                                           f'Отличная работа 😉')
-
-                    game_user.cards_in_hand.remove(game_user.sent_card)
-                    game_user.is_game_host = False
-                    game_user.answered = False
-                    game_user.sent_card = None
-                    game_user.answer = None
-                    game_user.save()
-
-                if won_user:
-                    end_game(game=game)
                     for game_user in game_users:
                         self.send_message(user_id=game_user.chat_id,
-                                          text=f'Игра завершена!\n'
-                                               f'Победитель: {won_user.name} 🥳',
-                                          keyboard=keyboards.get_main_menu_keyboard())
+                                          text=f'Баллы в этом круге:\n {users_card_answers_table}\n\n'
+                                               f'{get_game_results_table(game=game, user=game_user, game_users=game_users)}\n\n'
+                                               f'Отличная работа 😉')
+
+                    won_user = round_result.won_user
+                    if won_user:
+                        end_game(game=game)
+                        for game_user in game_users:
+                            self.send_message(user_id=game_user.chat_id,
+                                              text=f'Игра завершена!\n'
+                                                   f'Победитель: {won_user.name} 🥳',
+                                              keyboard=keyboards.get_main_menu_keyboard())
 
-                    return
+                        return
 
-                game_process = GameProcess(game=game)
-                game_process.give_game_users_one_card()
-                self.game_host_move(game)
+                    game_process = GameProcess(game=game)
+                    game_process.give_game_users_one_card()
+                    self.game_host_move(game)
 
             return
 
@@ -621,126 +815,157 @@ class VkBot:
                                   keyboard=keyboards.get_wait_circle_keyboard())
 
             user.answered = True
-            user.save()
+            save_user(user, 'current_score', 'answered')
 
             if not game.single and game.users.all().count() == game.users.filter(answered=True).count():
-                self.distribution_of_cards_in_game(game=game, users=game.users.all())
+                with self.outbound.batch(), transaction.atomic():
+                    if claim_game_transition(game):
+                        self.distribution_of_cards_in_game(game=game, users=game.users.all())
                 return
 
             if game.single:
                 game.stage = 'distribution_of_cards'
-                game.save()
+                save_game(game, 'stage')
 
     def distribution_of_cards_in_game(self, game, users, next_circle_text='Следующий круг'):
-        game.stage = 'getting_answers'
-        game.save()
-
-        game_process = GameProcess(game=game)
-        game_circle = game_process.start_circle()
-
-        need_end_game = False
-        for game_user in users:
-            game_user.answered = False
-
-            if not game_circle:
-                if game.single:
-                    self.send_message(user_id=game_user.chat_id, text=f'Игра звершена!\n'
-                                                                      f'Ваш счет: {game_user.current_score} ✅\n\n'
-                                                                      f'Отличная работа 😉',
-                                      keyboard=keyboards.get_main_menu_keyboard())
-                else:
-                    self.send_message(user_id=game_user.chat_id, text=f'Игра звершена!\n'
-                                                                      f'{get_game_results_table(game=game, user=game_user)}\n\n'
-                                                                      f'Отличная работа 😉',
-                                      keyboard=keyboards.get_main_menu_keyboard())
-                need_end_game = True
-
-                continue
-            if not need_end_game:
-                self.send_message(user_id=game_user.chat_id, text=next_circle_text,
-                                  photo_attachments=game_circle.attachment_data)
-                self.send_message(user_id=game_user.chat_id, text=game_circle.word,
-                                  keyboard=keyboards.get_answers_keyboard())
-                game_user.save()
+        with self.outbound.batch():
+            game.stage = 'getting_answers'
+            save_game(game, 'stage')
+
+            game_process = GameProcess(game=game)
+            game_circle = game_process.start_circle()
+
+            need_end_game = False
+            for game_user in users:
+                game_user.answered = False
+
+                if not game_circle:
+                    if game.single:
+                        self.send_message(user_id=game_user.chat_id, text=f'Игра звершена!\n'
+                                                                          f'Ваш счет: {game_user.current_score} ✅\n\n'
+                                                                          f'Отличная работа 😉',
+                                          keyboard=keyboards.get_main_menu_keyboard())
+                    else:
+                        self.send_message(user_id=game_user.chat_id, text=f'Игра звершена!\n'
+                                                                          f'{get_game_results_table(game=game, user=game_user)}\n\n'
+                                                                          f'Отличная работа 😉',
+                                          keyboard=keyboards.get_main_menu_keyboard())
+                    need_end_game = True
 
-        if need_end_game:
-            end_game(game)
+                    continue
+                if not need_end_game:
+                    self.send_message(user_id=game_user.chat_id, text=next_circle_text,
+                                      photo_attachments=game_circle.attachment_data)
+                    self.send_message(user_id=game_user.chat_id, text=game_circle.word,
+                                      keyboard=keyboards.get_answers_keyboard())
+                    save_user(game_user, 'answered')
+
+            if need_end_game:
+                end_game(game)
 
     def choosing_collection_by_url_step(self, event, user: models.VkUser):
         event_text = event.text
 
-        if event_text == 'назад':
+        if event_text.lower() == 'назад':
             self.send_message(user_id=event.user_id, text='Тогда в другой раз😊')
             self.send_message(user_id=event.user_id,
                               text='Выберите коллекцию изображений',
                               keyboard=keyboards.get_select_collection_keyboard())
             return
 
-        album_url = event_text
-
         try:
-            album_images = self.get_album_images(album_url=event_text)
+            parse_album_url(event_text)
         except:
-            self.send_message(user_id=event.user_id,
-                              text='Не удалось получить изображения из альбома\n'
-                                   'Указана некорректная ссылка, либо альбом является закрытым\n\n'
-                                   'Отправьте ссылку на альбом',
-                              keyboard=keyboards.get_back_keyboard())
-            self.register_next_step(event, self.choosing_collection_by_url_step)
+            self.send_album_error_message(user.chat_id, 'Указана некорректная ссылка')
             return
 
-        album_images_count = len(album_images)
-        if album_images_count < 6:
+        self.send_message(user_id=event.user_id, text='Загружаю альбом, это может занять некоторое время',
+                          keyboard=keyboards.get_back_keyboard())
+        # шаг регистрируется до запуска задачи, чтобы задача могла его снять, когда закончит
+        self.register_next_step(event, self.waiting_album_import_step)
+        self.jobs.submit(user.chat_id, 'import_album_job', event_text)
+
+    def waiting_album_import_step(self, event, user: models.VkUser):
+        if event.text.lower() == 'назад':
+            self.jobs.cancel(user.chat_id)
+            self.send_message(user_id=event.user_id, text='Загрузка альбома отменена')
             self.send_message(user_id=event.user_id,
-                              text='В этом альбоме слишком мало изображений с описанием\n'
-                                   'Укажите другой альбом', keyboard=keyboards.get_back_keyboard())
-            self.register_next_step(event, self.choosing_collection_by_url_step)
+                              text='Выберите коллекцию изображений',
+                              keyboard=keyboards.get_select_collection_keyboard())
             return
 
-        collection = models.Collection.objects.get_or_create(standard=False, album_url=album_url)[0]
+        self.send_message(user_id=event.user_id, text='Альбом ещё загружается, подождите немного',
+                          keyboard=keyboards.get_back_keyboard())
+        self.register_next_step(event, self.waiting_album_import_step)
 
-        if collection.images.count() != album_images_count:
-            collection.images.all().delete()
+    def import_album_job(self, job: Job, album_url: str):
+        """
+        Загрузка альбома из Вк. Изображения сохраняются и игра запускается шагом import_album_step.
+        """
+        try:
+            album_images = []
+            for album_image in iter_album_images(self.vk_standalone, album_url):
+                album_images.append(album_image)
+                if len(album_images) % 1000 == 0:
+                    job.progress(f'Загружено изображений: {len(album_images)}')
+        except JobCancelled:
+            raise
+        except:
+            logger.error(traceback.format_exc())
+            self.send_album_error_message(job.user_id, 'Указана некорректная ссылка, либо альбом является закрытым')
+            return
 
-            for album_image in album_images:
-                owner_id = album_image['owner_id']
-                photo_id = album_image['id']
+        if len(album_images) < 6:
+            self.send_album_error_message(job.user_id, 'В этом альбоме слишком мало изображений с описанием')
+            return
 
-                photo_text: str = album_image['text']
-                if not photo_text:
-                    continue
-                words = photo_text.lower().split()
+        job.check_cancelled()
+        self.submit_job_step(job, 'import_album_step', album_url, album_images)
 
-                image = collection.images.create(
-                    attachment_data=f'photo{owner_id}_{photo_id}'
-                )
+    def import_album_step(self, event: JobStepEvent, album_url: str, album_images: list):
+        """
+        Сохранение изображений альбома в пользовательскую коллекцию и запуск игры с ней.
+        """
+        chat_id = str(event.user_id)
+        next_step = self.next_steps.pop(chat_id)
+        if not next_step or next_step.name != self.waiting_album_import_step.__name__:
+            # пользователь отменил загрузку, пока шаг ждал в очереди
+            if next_step:
+                self.next_steps.set(chat_id, next_step)
+            return
 
-                image_words = [models.ImageWord(image=image, name=word) for word in words]
-                models.ImageWord.objects.bulk_create(image_words)
+        self.send_message(user_id=chat_id, text=f'Сохраняю изображения: {len(album_images)}', priority=PRIORITY_LOW)
+        try:
+            collection = models.Collection.objects.get_or_create(standard=False, album_url=album_url)[0]
+            if sync_album_images(collection, album_images).changed:
+                collection_snapshots.invalidate(collection.id)
+        except:
+            # без сообщения пользователь остался бы на шаге ожидания загрузки
+            logger.error(traceback.format_exc())
+            self.send_album_error_message(chat_id, 'Не удалось сохранить изображения, попробуйте ещё раз')
+            return
 
+        user = models.VkUser.objects.get(chat_id=chat_id)
+        if not user.current_game:
+            return
         if user.current_game.single:
             self.start_single_game(user, collection=collection)
         else:
             self.start_multiplayer_game(user, collection=collection)
 
-    def get_album_images(self, album_url):
-        album_id = album_url.split('/')[-1].split('_')[1]
-        owner_id = album_url.split('/')[-1].split('_')[0].replace('album', '')
-
-        values = {
-            'owner_id': owner_id,
-            'album_id': album_id
-        }
-
-        album_images = self.vk_standalone.method('photos.get', values)['items']
-        album_images = [album_image for album_image in album_images if album_image['text']]
-        return album_images
+    def send_album_error_message(self, user_id, reason: str):
+        self.send_message(user_id=user_id,
+                          text=f'Не удалось получить изображения из альбома\n'
+                               f'{reason}\n\n'
+                               f'Отправьте ссылку на альбом',
+                          keyboard=keyboards.get_back_keyboard())
+        self.register_next_step_by_user_id(user_id, self.choosing_collection_by_url_step)
 
     def connect_to_game(self, user, game):
         user.current_game = game
         user.current_score = 0
         user.answered = False
-        user.save()
+        save_user(user, 'current_game', 'current_score', 'answered')
 
         game_process = GameProcess(game=game)
         game_circle = game_process.get_current_circle()
@@ -761,40 +986,44 @@ class VkBot:
                               keyboard=keyboards.get_start_multiplayer_game_keyboard())
 
     def game_host_move(self, game: models.Game, start_game=False):
-        game_users = game.users.all()
-        host = game.users.filter(was_game_circle_host=False).first()
-        if not host:
-            game.users.update(was_game_circle_host=False)
-            host = game_users.first()
-        host.is_game_host = True
-        host.was_game_circle_host = True
-        host.save()
-
-        for user in game_users:
-            if start_game:
-                self.send_message(user_id=user.chat_id, text='Игра началась!')
-            else:
-                self.send_message(user_id=user.chat_id, text='Начинаем новый круг!')
+        with self.outbound.batch():
+            game_state = load_game_state(game)
+            host = next((player.user for player in game_state.players if not player.user.was_game_circle_host), None)
+            if not host:
+                game.users.update(was_game_circle_host=False)
+                for player in game_state.players:
+                    player.user.was_game_circle_host = False
+                host = game_state.players[0].user
+            host.is_game_host = True
+            host.was_game_circle_host = True
+            save_user(host, 'is_game_host', 'was_game_circle_host')
+
+            for player in game_state.players:
+                user = player.user
+                if start_game:
+                    self.send_message(user_id=user.chat_id, text='Игра началась!')
+                else:
+                    self.send_message(user_id=user.chat_id, text='Начинаем новый круг!')
 
-            photo_attachments = [image.attachment_data for image in user.cards_in_hand.all()]
+                photo_attachments = player.hand
 
-            if user == host:
-                self.send_message(user_id=user.chat_id, text=f'Вы ведущий этого круга\n'
-                                                             f'Загадайте одну из своих карт',
-                                  photo_attachments=photo_attachments,
-                                  keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
-            else:
-                self.send_message(user_id=user.chat_id, text=f'Ваши карты\n\n'
-                                                             f'Дождитесь пока ведущий загадает слово',
-                                  photo_attachments=photo_attachments,
-                                  keyboard=keyboards.get_wait_circle_keyboard())
+                if user == host:
+                    self.send_message(user_id=user.chat_id, text=f'Вы ведущий этого круга\n'
+                                                                 f'Загадайте одну из своих карт',
+                                      photo_attachments=photo_attachments,
+                                      keyboard=keyboards.get_answers_keyboard(count=len(photo_attachments)))
+                else:
+                    self.send_message(user_id=user.chat_id, text=f'Ваши карты\n\n'
+                                                                 f'Дождитесь пока ведущий загадает слово',
+                                      photo_attachments=photo_attachments,
+                                      keyboard=keyboards.get_wait_circle_keyboard())
 
-        game.current_images.set([])
-        game.current_attachment_data = None
-        game.current_correct_answer = None
-        game.current_word = ''
-        game.stage = 'game_host_writing_word'
-        game.save()
+            game.current_images.set([])
+            game.current_attachment_data = None
+            game.current_correct_answer = None
+            game.current_word = ''
+            game.stage = 'game_host_writing_word'
+            save_game(game, 'current_attachment_data', 'current_correct_answer', 'current_word', 'stage')
 
     def game_host_writing_word(self, game: models.Game, host):
         host = game.users.filter(is_game_host=True).first()
@@ -803,4 +1032,14 @@ class VkBot:
         self.send_message(user_id=host.chat_id, text=f'Введите слово, которое обозначет то, что изображено на карте')
 
 
-bot = VkBot(VK_BOT_TOKEN)
+bot: VkBot = None
+
+
+def get_bot() -> VkBot:
+    """
+    Бот процесса, создаётся при первом обращении.
+    """
+    global bot
+    if not bot:
+        bot = VkBot()
+    return bot
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+from vk_api.longpoll import VkEventType
+
+
+class CallbackEvent:
+    """
+    Событие Callback API, приведённое к интерфейсу события long poll (vk_api.longpoll.Event),
+    чтобы его можно было передать в VkBot.event_handling.
+    """
+
+    def __init__(self, message: dict):
+        self.raw = message
+        self.type = VkEventType.MESSAGE_NEW
+        self.message_id = message.get('id')
+        self.peer_id = message.get('peer_id')
+        self.user_id = message.get('from_id')
+        self.from_me = bool(message.get('out'))
+        self.to_me = not self.from_me
+        self.text = message.get('text', '')
+        self.message = self.text
+
+
+def parse_callback_event(data: dict):
+    """
+    Получение события из тела запроса Callback API.
+    Возвращает None для событий, которые бот не обрабатывает.
+    """
+    if data.get('type') != 'message_new':
+        return
+
+    event_object = data.get('object') or {}
+    # начиная с версии API 5.103 сообщение передаётся в поле message
+    message = event_object.get('message', event_object)
+    if not message.get('from_id'):
+        return
+    return CallbackEvent(message)
+
+
+class RecentEventIds:
+    """
+    Id недавно принятых событий Callback API. Вк повторяет событие, на которое не получил ответ вовремя,
+    с тем же event_id: повтор не обрабатывается второй раз. Хранится не больше max_size id в памяти процесса.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.ids: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, event_id) -> bool:
+        """
+        Запоминание id события. Возвращает False, если событие уже было принято.
+        """
+        with self.lock:
+            if event_id in self.ids:
+                return False
+            self.ids[event_id] = None
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+            return True
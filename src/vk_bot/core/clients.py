@@ -0,0 +1,33 @@
+import vk_api
+from vk_api import VkUpload
+from vk_api.longpoll import VkLongPoll
+
+from config.settings import VK_BOT_TOKEN, VK_STANDALONE_APP_ID, VK_STANDALONE_APP_TOKEN, VK_BOT_RPS, \
+    VK_STANDALONE_RPS
+from vk_bot.core.ratelimit import RateLimitedVkApi
+
+
+class VkClientFactory:
+    """
+    Создание клиентов Вк по настройкам.
+    Бот создаёт клиентов при первом обращении, поэтому токены проверяются только там, где Вк действительно нужен.
+    """
+
+    def create_bot_api(self) -> vk_api.VkApi:
+        if not VK_BOT_TOKEN:
+            raise ValueError('VK_BOT_TOKEN не может быть пустым')
+        return RateLimitedVkApi(token=VK_BOT_TOKEN, rps=VK_BOT_RPS)
+
+    def create_standalone_api(self) -> vk_api.VkApi:
+        if not VK_STANDALONE_APP_ID:
+            raise ValueError('VK_STANDALONE_APP_ID не может быть пустым')
+        if not VK_STANDALONE_APP_TOKEN:
+            raise ValueError('VK_STANDALONE_APP_TOKEN не может быть пустым')
+        return RateLimitedVkApi(app_id=VK_STANDALONE_APP_ID, token=VK_STANDALONE_APP_TOKEN, rps=VK_STANDALONE_RPS)
+
+    def create_long_poll(self, bot_api: vk_api.VkApi):
+        # подключение к Long Poll серверу выполняет запрос к Вк
+        return VkLongPoll(bot_api)
+
+    def create_upload(self, bot_api: vk_api.VkApi) -> VkUpload:
+        return VkUpload(bot_api)
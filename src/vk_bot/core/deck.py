@@ -0,0 +1,185 @@
+import random
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Union
+
+from vk_bot import models
+
+
+class CollectionSnapshot:
+    """
+    Неизменяемый снимок коллекции, общий для всех игр процесса.
+
+    Изображения (кроме retired) отсортированы по id и хранятся в массивах: id, вложения и слова изображений.
+    Слова изображения i - это words[word_ids[word_offsets[i]:word_offsets[i + 1]]].
+    """
+
+    def __init__(self, collection: models.Collection):
+        self.collection_id = collection.id
+        self.update_date = collection.update_date
+
+        images = list(collection.images.filter(retired=False).order_by('id').values_list('id', 'attachment_data'))
+        self.image_ids = array('q', (image_id for image_id, _ in images))
+        self.attachments = tuple(attachment_data for _, attachment_data in images)
+
+        image_words = {}
+        for image_id, word in models.ImageWord.objects.filter(image__collection=collection, image__retired=False) \
+                .order_by('image_id', 'id').values_list('image_id', 'name'):
+            image_words.setdefault(image_id, []).append(word)
+
+        word_indexes = {}
+        self.word_offsets = array('l', [0])
+        self.word_ids = array('l')
+        for image_id in self.image_ids:
+            for word in image_words.get(image_id, ()):
+                self.word_ids.append(word_indexes.setdefault(word, len(word_indexes)))
+            self.word_offsets.append(len(self.word_ids))
+        self.words = tuple(word_indexes)
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def get_index(self, image_id: int) -> Union[int, None]:
+        i = bisect_left(self.image_ids, image_id)
+        if i < len(self.image_ids) and self.image_ids[i] == image_id:
+            return i
+
+    def get_word_ids(self, index: int) -> array:
+        return self.word_ids[self.word_offsets[index]:self.word_offsets[index + 1]]
+
+
+class CollectionCache:
+    """
+    Снимки коллекций процесса. Снимок загружается заново, если коллекция была изменена (update_date).
+    """
+
+    def __init__(self, max_size: int = 100):
+        self.max_size = max_size
+        self.snapshots: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, collection: models.Collection) -> CollectionSnapshot:
+        with self.lock:
+            snapshot = self.snapshots.get(collection.id)
+            if snapshot and snapshot.update_date == collection.update_date:
+                self.snapshots.move_to_end(collection.id)
+                return snapshot
+
+        snapshot = CollectionSnapshot(collection)
+        with self.lock:
+            self.snapshots[collection.id] = snapshot
+            self.snapshots.move_to_end(collection.id)
+            while len(self.snapshots) > self.max_size:
+                self.snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, collection_id: int):
+        with self.lock:
+            self.snapshots.pop(collection_id, None)
+
+
+collection_snapshots = CollectionCache()
+
+
+class Deck:
+    """
+    Колода игры в памяти.
+
+    Карты тянутся из перемешанной колоды (индексы изображений снимка коллекции) без запросов к БД.
+    Использованные карты сохраняет вызывающий код.
+    """
+
+    def __init__(self, snapshot: CollectionSnapshot, used_image_ids=()):
+        self.snapshot = snapshot
+        self.used = set(used_image_ids)
+        draw_pile = [i for i, image_id in enumerate(snapshot.image_ids) if image_id not in self.used]
+        random.shuffle(draw_pile)
+        self.draw_pile = array('l', draw_pile)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.draw_pile)
+
+    def draw_circle(self, count: int = 5) -> Union[tuple, None]:
+        """
+        Карты для круга одиночной игры: загаданное изображение, слово и ещё count - 1 изображений без этого слова.
+        Возвращает (id загаданного изображения, слово, id всех изображений) или None, если карт не хватает.
+        """
+        with self.lock:
+            right_position = self._find_position(lambda index: len(self.snapshot.get_word_ids(index)))
+            if right_position is None:
+                return
+            right_word_id = random.choice(self.snapshot.get_word_ids(self.draw_pile[right_position]))
+
+            other_positions = []
+            for position in range(len(self.draw_pile) - 1, -1, -1):
+                if right_word_id not in self.snapshot.get_word_ids(self.draw_pile[position]):
+                    other_positions.append(position)
+                    if len(other_positions) == count - 1:
+                        break
+            if len(other_positions) < count - 1:
+                return
+
+            right_image_id = self.snapshot.image_ids[self.draw_pile[right_position]]
+            image_ids = [self._take(position) for position in sorted([right_position] + other_positions,
+                                                                      reverse=True)]
+            return right_image_id, self.snapshot.words[right_word_id], image_ids
+
+    def deal(self, count: int) -> list:
+        """
+        Раздача count карт из колоды.
+        """
+        with self.lock:
+            return [self._take(len(self.draw_pile) - 1) for _ in range(min(count, len(self.draw_pile)))]
+
+    def get_attachment_data(self, image_id: int) -> str:
+        return self.snapshot.attachments[self.snapshot.get_index(image_id)]
+
+    def _find_position(self, predicate):
+        for position in range(len(self.draw_pile) - 1, -1, -1):
+            if predicate(self.draw_pile[position]):
+                return position
+
+    def _take(self, position: int) -> int:
+        # колода перемешана, поэтому на место взятой карты можно поставить последнюю
+        image_id = self.snapshot.image_ids[self.draw_pile[position]]
+        self.draw_pile[position] = self.draw_pile[-1]
+        self.draw_pile.pop()
+        self.used.add(image_id)
+        return image_id
+
+
+class DeckCache:
+    """
+    Колоды активных игр процесса. Колода загружается заново, если изменилась коллекция
+    или использованные карты игры изменились в другом процессе.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.decks: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, game: models.Game) -> Deck:
+        snapshot = collection_snapshots.get(game.collection)
+        with self.lock:
+            deck = self.decks.get(game.id)
+            if deck:
+                self.decks.move_to_end(game.id)
+
+        if not deck or deck.snapshot is not snapshot or len(deck.used) != game.used_images.count():
+            deck = Deck(snapshot, game.used_images.values_list('id', flat=True))
+            with self.lock:
+                self.decks[game.id] = deck
+                while len(self.decks) > self.max_size:
+                    self.decks.popitem(last=False)
+        return deck
+
+    def delete(self, game_id: int):
+        with self.lock:
+            self.decks.pop(game_id, None)
+
+
+decks = DeckCache()
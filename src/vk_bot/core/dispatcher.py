@@ -0,0 +1,105 @@
+import queue
+import threading
+
+from django.db import close_old_connections, connection
+
+from config.logger import logger
+
+
+def get_workers_count(workers: int) -> int:
+    """
+    Количество воркеров, которое выдерживает БД.
+    SQLite не допускает одновременной записи из нескольких соединений: параллельные транзакции
+    завершаются ошибкой database is locked, поэтому с ним события обрабатываются одним воркером.
+    """
+    if workers > 1 and connection.vendor == 'sqlite':
+        logger.warning(f'SQLite не поддерживает параллельную запись, вместо {workers} воркеров используется 1')
+        return 1
+    return max(workers, 1)
+
+
+class EventDispatcher:
+    """
+    Параллельная обработка событий бота на пуле воркеров.
+
+    У каждого воркера своя ограниченная очередь. Событие направляется в очередь по ключу
+    (по умолчанию user_id), поэтому события одного пользователя обрабатываются строго по порядку.
+    Пока у пользователя есть необработанные события, новые события попадают к тому же воркеру,
+    даже если ключ изменился (например, пользователь подключился к игре).
+    Если очередь переполнена, submit блокируется до освобождения места или отбрасывает событие (block=False).
+    """
+
+    def __init__(self, handler, workers: int = 4, queue_size: int = 100, get_key=None):
+        self.handler = handler
+        self.get_key = get_key or (lambda event: event.user_id)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        # user_id: [индекс воркера, количество событий в обработке]
+        self.pending_users: {int: list} = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        for i, events_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(events_queue,), name=f'vk-bot-worker-{i}',
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Остановка воркеров после обработки уже принятых событий.
+        """
+        for events_queue in self.queues:
+            events_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, event, block: bool = True) -> bool:
+        """
+        Передача события воркеру. Если очередь воркера заполнена, блокируется,
+        а при block=False отбрасывает событие и возвращает False.
+        """
+        user_id = event.user_id
+        with self.lock:
+            pending = self.pending_users.get(user_id)
+            if pending:
+                pending[1] += 1
+            else:
+                pending = [hash(self.get_key(event)) % len(self.queues), 1]
+                self.pending_users[user_id] = pending
+        try:
+            self.queues[pending[0]].put(event, block=block)
+        except queue.Full:
+            self._done(user_id)
+            logger.warning(f'Очередь воркера {pending[0]} заполнена, событие пользователя {user_id} отброшено')
+            return False
+        return True
+
+    def queue_sizes(self) -> list:
+        return [events_queue.qsize() for events_queue in self.queues]
+
+    def _done(self, user_id):
+        with self.lock:
+            pending = self.pending_users[user_id]
+            pending[1] -= 1
+            if not pending[1]:
+                del self.pending_users[user_id]
+
+    def _work(self, events_queue: queue.Queue):
+        try:
+            while True:
+                event = events_queue.get()
+                if event is None:
+                    return
+                # разорванное соединение или соединение старше CONN_MAX_AGE открывается заново
+                close_old_connections()
+                try:
+                    self.handler(event)
+                except Exception:
+                    logger.exception('Ошибка обработки события')
+                finally:
+                    close_old_connections()
+                    self._done(event.user_id)
+        finally:
+            connection.close()
@@ -0,0 +1,103 @@
+import itertools
+import queue
+import threading
+import time
+from collections import Counter
+
+import vk_api
+from vk_api.longpoll import VkEventType
+
+from vk_bot.core.clients import VkClientFactory
+from vk_bot.core.ratelimit import PRIORITY_NORMAL
+
+
+class FakeVkApi(vk_api.VkApi):
+    """
+    VkApi в памяти процесса для бенчмарков: считает вызовы методов и отвечает правдоподобными данными.
+    latency - имитация времени ответа Вк в секундах.
+    """
+
+    def __init__(self, latency: float = 0):
+        super().__init__(token='fake')
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1)
+
+    def method(self, method, values=None, captcha_sid=None, captcha_key=None, raw=False,
+               priority: int = PRIORITY_NORMAL):
+        values = values or {}
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'users.get':
+            return [{'id': int(user_id), 'first_name': 'Игрок', 'last_name': str(user_id)}
+                    for user_id in str(values['user_ids']).split(',')]
+        if method == 'messages.send' and 'peer_ids' in values:
+            return [{'peer_id': int(peer_id), 'message_id': next(self.message_ids)}
+                    for peer_id in str(values['peer_ids']).split(',')]
+        if method == 'execute':
+            response = [next(self.message_ids) for _ in range(values['code'].count('API.'))]
+            return {'response': response} if raw else response
+        return next(self.message_ids)
+
+    def get_calls_count(self) -> int:
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class FakeEvent:
+    """
+    Входящее сообщение пользователя. processed выставляется обработчиком бенчмарка после обработки.
+    """
+    type = VkEventType.MESSAGE_NEW
+    to_me = True
+
+    def __init__(self, user_id: int, text: str):
+        self.user_id = user_id
+        self.text = text
+        self.processed = threading.Event()
+
+
+class FakeLongPoll:
+    """
+    VkLongPoll, события в который кладёт бенчмарк. listen завершается после stop.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def put(self, event: FakeEvent):
+        self.events.put(event)
+
+    def stop(self):
+        self.events.put(None)
+
+    def listen(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield event
+
+
+class FakeVkClientFactory(VkClientFactory):
+    """
+    Клиенты Вк в памяти процесса: бот отправляет запросы в FakeVkApi и получает события из FakeLongPoll.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.bot_api = FakeVkApi(latency=latency)
+        self.standalone_api = FakeVkApi(latency=latency)
+        self.long_poll = FakeLongPoll()
+
+    def create_bot_api(self) -> FakeVkApi:
+        return self.bot_api
+
+    def create_standalone_api(self) -> FakeVkApi:
+        return self.standalone_api
+
+    def create_long_poll(self, bot_api) -> FakeLongPoll:
+        return self.long_poll
@@ -2,10 +2,12 @@ import random
 from dataclasses import dataclass
 from typing import Union
 
-from django.db.models import Q
+from django.db.models import Q, F
 
 from config.logger import logger
 from vk_bot import models
+from vk_bot.core import metrics
+from vk_bot.core.deck import decks
 
 
 @dataclass
@@ -26,40 +28,27 @@ class GameProcess:
         self.game = game
         self.collection = game.collection
 
+    @metrics.handler_seconds.timed('start_circle')
     def start_circle(self) -> Union[GameCircle, None]:
-        images = self.game.collection.images.order_by('?')
-        used_images_ids = self.game.used_images.values_list('id', flat=True)
-        if used_images_ids:
-            images = images.exclude(id__in=used_images_ids)
-
-        if not images:
+        deck = decks.get(self.game)
+        circle = deck.draw_circle()
+        if not circle:
             return
+        right_image_id, right_word, image_ids = circle
 
-        words = images.values_list('words__name', flat=True).distinct()
-        right_word = random.choice(words)
-
-        other_images = images.filter(~Q(words__name=right_word))[:4]
-        right_image: models.Image = images.filter(words__name=right_word).first()
+        self.game.used_images.add(*image_ids)
+        self.game.current_images.set(image_ids)
 
-        self.game.used_images.add(*other_images)
-        self.game.used_images.add(right_image)
-
-        current_images = [right_image] + list(other_images)
-        self.game.current_images.set(current_images)
-
-        attachment_data = [image.attachment_data for image in current_images]
-        random.shuffle(attachment_data, random.random)
-
-        if len(attachment_data) < 5:
-            return
+        attachment_data = [deck.get_attachment_data(image_id) for image_id in image_ids]
+        random.shuffle(attachment_data)
 
         self.game.current_attachment_data = attachment_data
         self.game.current_word = right_word
-        self.game.current_correct_answer = attachment_data.index(right_image.attachment_data) + 1
-        logger.info(f'game: {self.game.id}, current_correct_answer: {self.game.current_correct_answer}')
+        self.game.current_correct_answer = attachment_data.index(deck.get_attachment_data(right_image_id)) + 1
+        logger.info('game: %s, current_correct_answer: %s', self.game.id, self.game.current_correct_answer)
 
         self.game.stage = 'getting_answers'
-        self.game.save()
+        save_game(self.game, 'current_attachment_data', 'current_word', 'current_correct_answer', 'stage')
 
         return GameCircle(attachment_data=attachment_data, word=f'Загаданное слово: {right_word}')
 
@@ -68,27 +57,26 @@ class GameProcess:
                           word=f'Загаданное слово: {self.game.current_word}')
 
     def init_game_with_host(self):
-        users = self.game.users.all()
-        users_count = users.count()
-        images = self.game.collection.images.order_by('?')
+        users = list(self.game.users.all())
+        deck = decks.get(self.game)
 
-        i = 0
+        dealt_image_ids = []
         for user in users:
-            dealt_images = images[i: i + users_count]
-            user.cards_in_hand.set(dealt_images)
-            self.game.used_images.add(*dealt_images)
-
-            i += i + users_count
+            user_image_ids = deck.deal(len(users))
+            user.cards_in_hand.set(user_image_ids)
+            dealt_image_ids += user_image_ids
+        self.game.used_images.add(*dealt_image_ids)
 
     def give_game_users_one_card(self):
-        users = self.game.users.all()
-        images = self.game.collection.images.order_by('?')
+        users = list(self.game.users.all())
+        deck = decks.get(self.game)
 
-        i = 0
+        dealt_image_ids = []
         for user in users:
-            user.cards_in_hand.add(images[i])
-            self.game.used_images.add(images[i])
-            i += 1
+            user_image_ids = deck.deal(1)
+            user.cards_in_hand.add(*user_image_ids)
+            dealt_image_ids += user_image_ids
+        self.game.used_images.add(*dealt_image_ids)
 
     def start_circle_with_host(self, ) -> Union[GameCircle, None]:
         images = self.game.collection.images.order_by('?')
@@ -112,7 +100,7 @@ class GameProcess:
         self.game.current_images.set(current_images)
 
         attachment_data = [image.attachment_data for image in current_images]
-        random.shuffle(attachment_data, random.random)
+        random.shuffle(attachment_data)
 
         if len(attachment_data) < 5:
             return
@@ -120,10 +108,10 @@ class GameProcess:
         self.game.current_attachment_data = attachment_data
         self.game.current_word = right_word
         self.game.current_correct_answer = attachment_data.index(right_image.attachment_data) + 1
-        logger.info(f'game: {self.game.id}, current_correct_answer: {self.game.current_correct_answer}')
+        logger.info('game: %s, current_correct_answer: %s', self.game.id, self.game.current_correct_answer)
 
         self.game.stage = 'getting_answers'
-        self.game.save()
+        save_game(self.game, 'current_attachment_data', 'current_word', 'current_correct_answer', 'stage')
 
         return GameCircle(attachment_data=attachment_data, word=f'Загаданное слово: {right_word}')
 
@@ -134,7 +122,7 @@ def clear_user_game_data(user: models.VkUser):
     user.answered = False
     user.is_game_host = False
     user.answer = None
-    user.save()
+    save_user(user, 'current_game', 'current_score', 'answered', 'is_game_host', 'answer')
 
 
 def end_game(game: models.Game):
@@ -144,11 +132,48 @@ def end_game(game: models.Game):
                       answered=False,
                       is_game_host=False,
                       answer=None)
-    game.save()
-
-
-def get_game_results_table(game: models.Game, user: models.VkUser) -> str:
-    game_users = game.users.order_by('-current_score').distinct()
+    save_game(game, 'status')
+
+
+def save_game(game: models.Game, *fields: str):
+    """
+    Сохранение изменённых полей игры. Версию меняет только claim_game_transition:
+    полное сохранение копии, загруженной до перехода, вернуло бы старую версию и сняло бы защиту.
+    """
+    game.save(update_fields=[*fields, 'update_date'])
+
+
+def save_user(user: models.VkUser, *fields: str):
+    """
+    Сохранение изменённых полей пользователя. Полное сохранение копии, загруженной другим обработчиком,
+    вернуло бы поля, которые он уже изменил (например, имя из кэша UserNamesRefresher).
+    """
+    user.save(update_fields=[*fields, 'update_date'])
+
+
+def claim_game_transition(game: models.Game) -> bool:
+    """
+    Захват перехода игры к следующему кругу или стадии: из одновременных вызовов с одной версией игры
+    True получит только один.
+
+    Условный UPDATE по версии атомарен в любой БД, в том числе в SQLite, где select_for_update не поддерживается.
+    Вызывать внутри transaction.atomic, чтобы при ошибке во время перехода версия откатилась.
+    """
+    updated = models.Game.objects.filter(id=game.id, version=game.version).update(version=F('version') + 1)
+    if not updated:
+        return False
+    game.version += 1
+    return True
+
+
+def get_game_results_table(game: models.Game, user: models.VkUser, game_users: list = None) -> str:
+    """
+    Таблица результатов игры. Если игроки уже загружены, запрос к БД не выполняется.
+    """
+    if game_users is None:
+        game_users = game.users.order_by('-current_score').distinct()
+    else:
+        game_users = sorted(game_users, key=lambda game_user: -game_user.current_score)
 
     result = 'Общий счет\n===============\n'
     i = 1
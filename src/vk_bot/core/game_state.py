@@ -0,0 +1,46 @@
+from dataclasses import dataclass, field
+from typing import Union
+
+from django.db.models import Prefetch
+
+from vk_bot import models
+
+
+@dataclass
+class PlayerState:
+    user: models.VkUser
+    # вложения карт на руке в порядке их номеров на клавиатуре
+    hand: list = field(default_factory=list)
+    sent_card: Union[str, None] = None
+
+
+@dataclass
+class GameState:
+    """
+    Снимок игроков игры: руки и отправленные карты загружаются вместе с игроками.
+    """
+    players: list
+
+    @property
+    def host(self) -> Union[PlayerState, None]:
+        for player in self.players:
+            if player.user.is_game_host:
+                return player
+
+    def get_not_hosts(self) -> list:
+        return [player for player in self.players if not player.user.is_game_host]
+
+
+def load_game_state(game: models.Game) -> GameState:
+    """
+    Загрузка игроков игры, их рук и отправленных карт за два запроса независимо от количества игроков.
+    """
+    users = game.users.select_related('sent_card').prefetch_related(
+        Prefetch('cards_in_hand', queryset=models.Image.objects.only('id', 'attachment_data'))
+    )
+    players = []
+    for user in users:
+        players.append(PlayerState(user=user,
+                                   hand=[image.attachment_data for image in user.cards_in_hand.all()],
+                                   sent_card=user.sent_card.attachment_data if user.sent_card else None))
+    return GameState(players=players)
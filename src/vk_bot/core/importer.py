@@ -0,0 +1,165 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from django.db import transaction
+
+from vk_bot import models
+
+# максимальное количество фотографий в одном запросе photos.get
+PHOTOS_GET_MAX_COUNT = 1000
+
+WORD_RE = re.compile(r'\w+(?:-\w+)*')
+
+
+@dataclass
+class AlbumImage:
+    attachment_data: str
+    words: list = field(default_factory=list)
+
+
+def parse_album_url(album_url: str) -> tuple:
+    """
+    Получение владельца и id альбома из ссылки вида https://vk.com/album-123_456
+    """
+    album = album_url.strip().split('?')[0].rstrip('/').split('/')[-1]
+    owner_id, album_id = album.replace('album', '').split('_')[:2]
+    return owner_id, album_id
+
+
+def normalize_caption(text: str) -> list:
+    """
+    Слова описания фотографии: в нижнем регистре, без знаков препинания и повторов.
+    """
+    return list(dict.fromkeys(WORD_RE.findall(text.lower())))
+
+
+def iter_album_photos(vk_api, owner_id, album_id, page_size: int = PHOTOS_GET_MAX_COUNT,
+                      workers: int = 4) -> Iterator[dict]:
+    """
+    Все фотографии альбома. Первая страница даёт общее количество, остальные загружаются параллельно
+    и отдаются по порядку по мере получения.
+    """
+    values = {'owner_id': owner_id, 'album_id': album_id, 'count': page_size}
+    first_page = vk_api.method('photos.get', dict(values, offset=0))
+    yield from first_page['items']
+
+    offsets = range(page_size, first_page['count'], page_size)
+    if not offsets:
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vk-album-import') as executor:
+        pages = executor.map(lambda offset: vk_api.method('photos.get', dict(values, offset=offset)), offsets)
+        for page in pages:
+            yield from page['items']
+
+
+def iter_album_images(vk_api, album_url: str, **kwargs) -> Iterator[AlbumImage]:
+    """
+    Фотографии альбома с непустым описанием.
+    """
+    owner_id, album_id = parse_album_url(album_url)
+    for photo in iter_album_photos(vk_api, owner_id, album_id, **kwargs):
+        words = normalize_caption(photo.get('text') or '')
+        if words:
+            yield AlbumImage(attachment_data=f'photo{photo["owner_id"]}_{photo["id"]}', words=words)
+
+
+@dataclass
+class SyncResult:
+    created: int = 0
+    updated: int = 0
+    retired: int = 0
+    restored: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.created or self.updated or self.retired or self.restored)
+
+
+def sync_album_images(collection: models.Collection, album_images: Iterable[AlbumImage],
+                      batch_size: int = 1000) -> SyncResult:
+    """
+    Синхронизация изображений коллекции с альбомом по идентификатору фотографии (attachment_data).
+
+    Записываются только изменения: новые фотографии добавляются, у изменённых заменяются слова,
+    удалённые из альбома помечаются retired и не попадают в новые круги, но остаются в БД для идущих игр.
+    """
+    album_images = {album_image.attachment_data: album_image for album_image in album_images}
+
+    images = {attachment_data: (image_id, retired) for image_id, attachment_data, retired
+              in collection.images.values_list('id', 'attachment_data', 'retired')}
+    image_words = {}
+    for image_id, word in models.ImageWord.objects.filter(image__collection=collection) \
+            .order_by('image_id', 'id').values_list('image_id', 'name'):
+        image_words.setdefault(image_id, []).append(word)
+
+    new_images = [album_image for attachment_data, album_image in album_images.items()
+                  if attachment_data not in images]
+    changed_images = {}
+    restored_ids = []
+    retired_ids = []
+    for attachment_data, (image_id, retired) in images.items():
+        album_image = album_images.get(attachment_data)
+        if not album_image:
+            if not retired:
+                retired_ids.append(image_id)
+            continue
+        if retired:
+            restored_ids.append(image_id)
+        if image_words.get(image_id, []) != album_image.words:
+            changed_images[image_id] = album_image
+
+    result = SyncResult(created=len(new_images), updated=len(changed_images),
+                        retired=len(retired_ids), restored=len(restored_ids))
+    if not result.changed:
+        return result
+
+    # каждая пачка сохраняется своей транзакцией: одна транзакция на весь альбом надолго блокировала бы запись
+    # в БД (SQLite блокирует всю базу). Прерванную синхронизацию продолжит повторный импорт альбома.
+    try:
+        for batch in _batches(new_images, batch_size):
+            with transaction.atomic():
+                _create_images(collection, batch)
+
+        for batch in _batches(list(changed_images.items()), batch_size):
+            with transaction.atomic():
+                models.ImageWord.objects.filter(image_id__in=[image_id for image_id, _ in batch]).delete()
+                models.ImageWord.objects.bulk_create(
+                    [models.ImageWord(image_id=image_id, name=word)
+                     for image_id, album_image in batch for word in album_image.words],
+                    batch_size=5000)
+
+        for batch in _batches(retired_ids, batch_size):
+            models.Image.objects.filter(id__in=batch).update(retired=True)
+        for batch in _batches(restored_ids, batch_size):
+            models.Image.objects.filter(id__in=batch).update(retired=False)
+    finally:
+        # обновление update_date сбрасывает снимок коллекции в кэше всех процессов, в том числе после ошибки
+        collection.save()
+    return result
+
+
+def _batches(items: list, batch_size: int) -> Iterator[list]:
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def _create_images(collection: models.Collection, album_images: list) -> int:
+    images = models.Image.objects.bulk_create(
+        [models.Image(collection=collection, attachment_data=album_image.attachment_data)
+         for album_image in album_images])
+
+    if any(image.pk is None for image in images):
+        # БД не возвращает id созданных строк
+        image_ids = dict(collection.images.filter(
+            attachment_data__in=[album_image.attachment_data for album_image in album_images]
+        ).values_list('attachment_data', 'id'))
+        for image in images:
+            image.pk = image_ids[image.attachment_data]
+
+    models.ImageWord.objects.bulk_create(
+        [models.ImageWord(image=image, name=word)
+         for image, album_image in zip(images, album_images) for word in album_image.words],
+        batch_size=5000)
+    return len(images)
@@ -0,0 +1,238 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+
+from django.db import close_old_connections
+
+from config.logger import logger, logging_context
+from vk_bot import models
+from vk_bot.core import metrics
+from vk_bot.core.dispatcher import get_workers_count
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    Фоновая задача пользователя: имя обработчика и его аргументы.
+    Обработчик сообщает о прогрессе через progress и проверяет отмену через check_cancelled.
+    """
+
+    def __init__(self, job_queue: 'JobQueue', job_id, user_id, name: str, args=(), kwargs=None):
+        self.queue = job_queue
+        self.id = job_id
+        self.user_id = user_id
+        self.name = name
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+        self.last_progress = 0
+
+    def check_cancelled(self):
+        if self.queue.is_cancelled(self):
+            raise JobCancelled()
+
+    def progress(self, text: str):
+        """
+        Сообщение пользователю о ходе выполнения, не чаще раза в progress_interval секунд.
+        """
+        self.check_cancelled()
+        now = time.monotonic()
+        if self.queue.notify and now - self.last_progress >= self.queue.progress_interval:
+            self.last_progress = now
+            self.queue.notify(self.user_id, text)
+
+
+class JobStepEvent:
+    """
+    Продолжение фоновой задачи, которое выполняет обработчик событий: name - метод бота, принимающий событие
+    и аргументы. Шаг обрабатывается по порядку с событиями пользователя и в потоке, который пишет в БД
+    (с SQLite он один, см. get_workers_count), поэтому задачи не меняют игру в обход обработчиков событий.
+    """
+
+    type = 'job_step'
+    to_me = True
+    text = ''
+
+    def __init__(self, user_id, name: str, args=(), kwargs=None):
+        # id пользователя числом, как в событиях Вк: по нему события распределяются по воркерам
+        self.user_id = int(user_id)
+        self.name = name
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+
+
+class JobQueue(ABC):
+    """
+    Очередь фоновых задач с пулом воркеров, которые запускаются при первой задаче (с SQLite воркер один).
+    runner(job) выполняет задачу, notify(user_id, text) отправляет пользователю сообщение о прогрессе.
+    Изменения игр и пользователей задача передаёт обработчикам событий через JobStepEvent.
+    """
+
+    def __init__(self, runner, workers: int = 2, notify=None, progress_interval: float = 3):
+        self.runner = runner
+        self.workers = workers
+        self.notify = notify
+        self.progress_interval = progress_interval
+        self.threads = []
+        self.lock = threading.Lock()
+        metrics.queue_size.set_function('jobs', lambda: {('jobs',): self.get_size()})
+
+    def submit(self, user_id, name: str, *args, **kwargs) -> Job:
+        self.start()
+        return self._put(user_id, name, args, kwargs)
+
+    @abstractmethod
+    def cancel(self, user_id):
+        """
+        Отмена ожидающих и выполняемых задач пользователя.
+        """
+
+    @abstractmethod
+    def is_cancelled(self, job: Job) -> bool:
+        pass
+
+    @abstractmethod
+    def get_size(self) -> int:
+        """
+        Количество задач, ожидающих выполнения.
+        """
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(get_workers_count(self.workers)):
+                thread = threading.Thread(target=self._work, name=f'vk-bot-job-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    @abstractmethod
+    def _put(self, user_id, name: str, args, kwargs) -> Job:
+        pass
+
+    @abstractmethod
+    def _take(self) -> Job:
+        pass
+
+    @abstractmethod
+    def _finish(self, job: Job, status: str):
+        pass
+
+    def _work(self):
+        while True:
+            job = self._take()
+            status = 'done'
+            with logging_context(user=job.user_id, job=job.name):
+                try:
+                    self.runner(job)
+                except JobCancelled:
+                    status = 'cancelled'
+                except Exception:
+                    logger.error(traceback.format_exc())
+                    status = 'failed'
+                finally:
+                    close_old_connections()
+            self._finish(job, status)
+
+
+class MemoryJobQueue(JobQueue):
+    """
+    Задачи в памяти процесса. Невыполненные задачи теряются при перезапуске.
+    """
+
+    def __init__(self, runner, workers: int = 2, notify=None, progress_interval: float = 3):
+        super().__init__(runner, workers, notify, progress_interval)
+        self.queue = queue.Queue()
+        self.ids = itertools.count(1)
+        self.user_jobs: {object: set} = {}
+        self.cancelled = set()
+
+    def cancel(self, user_id):
+        with self.lock:
+            self.cancelled.update(self.user_jobs.get(user_id, ()))
+
+    def is_cancelled(self, job: Job) -> bool:
+        return job.id in self.cancelled
+
+    def get_size(self) -> int:
+        return self.queue.qsize()
+
+    def _put(self, user_id, name: str, args, kwargs) -> Job:
+        job = Job(self, next(self.ids), user_id, name, args, kwargs)
+        with self.lock:
+            self.user_jobs.setdefault(user_id, set()).add(job.id)
+        self.queue.put(job)
+        return job
+
+    def _take(self) -> Job:
+        while True:
+            job = self.queue.get()
+            if not self.is_cancelled(job):
+                return job
+            self._finish(job, 'cancelled')
+
+    def _finish(self, job: Job, status: str):
+        with self.lock:
+            self.cancelled.discard(job.id)
+            user_jobs = self.user_jobs.get(job.user_id, set())
+            user_jobs.discard(job.id)
+            if not user_jobs:
+                self.user_jobs.pop(job.user_id, None)
+
+
+class DatabaseJobQueue(JobQueue):
+    """
+    Задачи в таблице БД: переживают перезапуск и выполняются воркерами любого процесса.
+    """
+
+    def __init__(self, runner, workers: int = 2, notify=None, progress_interval: float = 3,
+                 poll_interval: float = 1):
+        super().__init__(runner, workers, notify, progress_interval)
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+
+    def cancel(self, user_id):
+        models.BackgroundJob.objects.filter(chat_id=str(user_id), status__in=['pending', 'running']) \
+            .update(status='cancelled')
+
+    def is_cancelled(self, job: Job) -> bool:
+        return models.BackgroundJob.objects.filter(id=job.id, status='cancelled').exists()
+
+    def get_size(self) -> int:
+        return models.BackgroundJob.objects.filter(status='pending').count()
+
+    def _put(self, user_id, name: str, args, kwargs) -> Job:
+        background_job = models.BackgroundJob.objects.create(chat_id=str(user_id), name=name,
+                                                             args=list(args), kwargs=kwargs)
+        with self.condition:
+            self.condition.notify()
+        return Job(self, background_job.id, user_id, name, args, kwargs)
+
+    def _take(self) -> Job:
+        while True:
+            for background_job in models.BackgroundJob.objects.filter(status='pending').order_by('id')[:10]:
+                # задачу заберёт только один воркер: остальные обновят 0 строк
+                if models.BackgroundJob.objects.filter(id=background_job.id, status='pending') \
+                        .update(status='running'):
+                    return Job(self, background_job.id, background_job.chat_id, background_job.name,
+                               background_job.args, background_job.kwargs)
+            close_old_connections()
+            with self.condition:
+                self.condition.wait(self.poll_interval)
+
+    def _finish(self, job: Job, status: str):
+        # отменённая во время выполнения задача остаётся отменённой
+        models.BackgroundJob.objects.filter(id=job.id, status='running').update(status=status)
+
+
+def get_job_queue(backend: str, runner, workers: int = 2, notify=None) -> JobQueue:
+    if backend == 'memory':
+        return MemoryJobQueue(runner, workers=workers, notify=notify)
+    if backend == 'db':
+        return DatabaseJobQueue(runner, workers=workers, notify=notify)
+    raise ValueError(f'Неизвестная очередь задач: {backend}')
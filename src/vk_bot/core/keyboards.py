@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from functools import lru_cache
 
 from vk_api.keyboard import VkKeyboardColor, VkKeyboard
 
@@ -9,16 +10,21 @@ class KeyBoardButton:
     color: VkKeyboardColor = VkKeyboardColor.PRIMARY
 
 
-def get_keyboard(button_rows: list[list[KeyBoardButton]], inline=False, one_time=False):
+def get_keyboard(button_rows: list[list[KeyBoardButton]], inline=False, one_time=False) -> str:
+    """
+    JSON клавиатуры для messages.send.
+    Функции ниже кэшируют результат, поэтому каждая клавиатура собирается и сериализуется один раз.
+    """
     keyboard = VkKeyboard(inline=inline, one_time=one_time)
     for row in button_rows:
         for button in row:
             keyboard.add_button(label=button.text, color=button.color)
         if row != button_rows[-1]:
             keyboard.add_line()
-    return keyboard
+    return keyboard.get_keyboard()
 
 
+@lru_cache(maxsize=32)
 def get_answers_keyboard(count=5):
     button_rows = []
     row = []
@@ -34,6 +40,7 @@ def get_answers_keyboard(count=5):
     return get_keyboard(button_rows, one_time=True)
 
 
+@lru_cache(maxsize=None)
 def get_next_circle_keyboard():
     button_rows = [
         [KeyBoardButton(text='Следующий круг', color=VkKeyboardColor.POSITIVE)],
@@ -43,6 +50,7 @@ def get_next_circle_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard():
     button_rows = [
         [KeyBoardButton(text='Одиночная игра')],
@@ -51,6 +59,7 @@ def get_main_menu_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_select_collection_keyboard():
     button_rows = [
         [KeyBoardButton(text='Загрузить свою', color=VkKeyboardColor.POSITIVE)],
@@ -60,6 +69,7 @@ def get_select_collection_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_back_keyboard():
     button_rows = [
         [KeyBoardButton(text='Назад', color=VkKeyboardColor.SECONDARY)]
@@ -67,6 +77,7 @@ def get_back_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_multiplayer_keyboard():
     button_rows = [
         [KeyBoardButton(text='Создать игру', color=VkKeyboardColor.POSITIVE)],
@@ -77,6 +88,7 @@ def get_multiplayer_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=1000)
 def get_connect_to_game_keyboard(game_id):
     button_rows = [
         [KeyBoardButton(text=f'Подключиться к игре #{game_id}')],
@@ -84,6 +96,7 @@ def get_connect_to_game_keyboard(game_id):
     return get_keyboard(button_rows, inline=True)
 
 
+@lru_cache(maxsize=None)
 def get_wait_circle_keyboard():
     button_rows = [
         [KeyBoardButton(text='Таблица результатов')],
@@ -92,6 +105,7 @@ def get_wait_circle_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_leave_game_keyboard():
     button_rows = [
         [KeyBoardButton(text='Покинуть игру', color=VkKeyboardColor.NEGATIVE)]
@@ -99,6 +113,7 @@ def get_leave_game_keyboard():
     return get_keyboard(button_rows)
 
 
+@lru_cache(maxsize=None)
 def get_start_multiplayer_game_keyboard():
     button_rows = [
         [KeyBoardButton(text='Начать игру', color=VkKeyboardColor.POSITIVE)],
@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connections
+
+from config.logger import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{escape_label(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric(ABC):
+    type = ''
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+    def render(self) -> list:
+        header = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        return header + self.render_samples()
+
+    @abstractmethod
+    def render_samples(self) -> list:
+        pass
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: {tuple: float} = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render_samples(self) -> list:
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{format_labels(self.label_names, labels)} {value}' for labels, value in values]
+
+
+class Gauge(Metric):
+    """
+    Значения вычисляются при выгрузке метрик функциями, возвращающими {значения меток: значение}.
+    Функция с тем же ключом заменяет предыдущую (например, при перезапуске polling).
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.callbacks = {}
+
+    def set_function(self, key: str, callback):
+        with self.lock:
+            self.callbacks[key] = callback
+
+    def render_samples(self) -> list:
+        with self.lock:
+            callbacks = list(self.callbacks.values())
+        samples = []
+        for callback in callbacks:
+            try:
+                values = callback()
+            except Exception:
+                logger.error(traceback.format_exc())
+                continue
+            samples += [f'{self.name}{format_labels(self.label_names, labels)} {value}'
+                        for labels, value in values.items()]
+        return samples
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+        # значения меток -> (количество в каждом интервале, сумма, общее количество)
+        self.values: {tuple: list} = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def timed(self, *label_values):
+        """
+        Декоратор: время выполнения функции.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(*label_values):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render_samples(self) -> list:
+        with self.lock:
+            values = [(labels, list(counts[0]), counts[1], counts[2]) for labels, counts in self.values.items()]
+        samples = []
+        for labels, bucket_counts, total, count in values:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.label_names, labels, f'le="{bucket}"')
+                samples.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            samples.append(f'{self.name}_sum{format_labels(self.label_names, labels)} {total}')
+            samples.append(f'{self.name}_count{format_labels(self.label_names, labels)} {count}')
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: {str: Metric} = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+registry = MetricsRegistry()
+
+events_total = registry.register(Counter('vk_bot_events_total', 'Полученные события Вк', ('type',)))
+handler_seconds = registry.register(Histogram('vk_bot_handler_seconds', 'Время выполнения обработчиков',
+                                              ('handler',)))
+event_db_queries = registry.register(Histogram('vk_bot_event_db_queries', 'Запросы к БД при обработке события',
+                                               ('handler',), buckets=DB_QUERIES_BUCKETS))
+event_seconds = registry.register(Histogram('vk_bot_event_seconds', 'Время обработки события', ('handler',)))
+vk_api_requests_total = registry.register(Counter('vk_api_requests_total', 'Запросы к API Вк',
+                                                  ('method', 'status')))
+vk_api_request_seconds = registry.register(Histogram('vk_api_request_seconds', 'Время запросов к API Вк',
+                                                     ('method',)))
+queue_size = registry.register(Gauge('vk_bot_queue_size', 'Размер очередей бота', ('queue',)))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            body = registry.render().encode()
+        finally:
+            # запрос обрабатывается в отдельном потоке, соединения с БД функций метрик нужно закрыть
+            connections.close_all()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='vk-bot-metrics', daemon=True).start()
+    logger.info(f'Метрики доступны на http://{host}:{port}/metrics')
+    return server
+
+
+def start_textfile_writer(path: str, interval: float = 15) -> threading.Thread:
+    """
+    Периодическая запись метрик в файл (например, для textfile collector node_exporter).
+    """
+    def write():
+        while True:
+            try:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(registry.render())
+                os.replace(tmp_path, path)
+            except Exception:
+                logger.error(traceback.format_exc())
+            time.sleep(interval)
+
+    thread = threading.Thread(target=write, name='vk-bot-metrics-textfile', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,185 @@
+import json
+import threading
+from contextlib import contextmanager
+
+from vk_api.utils import sjson_dumps
+
+from config.logger import logger
+from vk_bot.core.ratelimit import PRIORITY_NORMAL, RETRY_ERROR_CODES
+
+# ограничения Вк: количество обращений к API в одном execute и получателей в peer_ids
+EXECUTE_MAX_CALLS = 25
+PEER_IDS_MAX = 100
+
+EXECUTE_CALL_PREFIX = 'API.messages.send('
+
+
+def get_execute_code(calls: list) -> str:
+    """
+    Код execute, отправляющий сообщения [параметры messages.send] и возвращающий их результаты.
+    """
+    return 'return [' + ','.join(f'{EXECUTE_CALL_PREFIX}{sjson_dumps(values)})' for values in calls) + '];'
+
+
+def get_execute_calls(code: str) -> list:
+    """
+    Параметры вызовов messages.send из кода, собранного get_execute_code.
+    """
+    decoder = json.JSONDecoder()
+    calls = []
+    position = code.find(EXECUTE_CALL_PREFIX)
+    while position != -1:
+        values, position = decoder.raw_decode(code, position + len(EXECUTE_CALL_PREFIX))
+        calls.append(values)
+        position = code.find(EXECUTE_CALL_PREFIX, position)
+    return calls
+
+
+def send_request(vk_api, method: str, values: dict, priority: int = PRIORITY_NORMAL):
+    """
+    Выполнение запроса пачки сообщений.
+    Ошибка вызова внутри execute не прерывает запрос: Вк возвращает False вместо результата и описание
+    в execute_errors. Вызовы, не выполненные из-за лимитов и внутренних ошибок Вк, повторяются по одному,
+    остальные ошибки пишутся в лог.
+    """
+    if method != 'execute':
+        return vk_api.method(method, values, priority=priority)
+
+    response = vk_api.method(method, values, raw=True, priority=priority)
+    results = response.get('response') or []
+    failed_indexes = [i for i, result in enumerate(results) if result is False]
+    if not failed_indexes and not response.get('execute_errors'):
+        return results
+
+    errors = response.get('execute_errors') or []
+    calls = get_execute_calls(values['code'])
+    for error_index, call_index in enumerate(failed_indexes):
+        error = errors[error_index] if error_index < len(errors) else {}
+        call_values = calls[call_index]
+        recipient = call_values.get('user_id') or call_values.get('peer_ids')
+        if error.get('error_code') in RETRY_ERROR_CODES:
+            logger.warning(f'execute: сообщение {recipient} не отправлено ({error.get("error_msg")}), повтор')
+            try:
+                results[call_index] = vk_api.method('messages.send', call_values, priority=priority)
+            except Exception as e:
+                logger.error(f'execute: сообщение {recipient} не отправлено повторно: {e}')
+        else:
+            logger.error(f'execute: сообщение {recipient} не отправлено: '
+                         f'[{error.get("error_code")}] {error.get("error_msg")}')
+    return results
+
+
+class MessageBatch:
+    """
+    Накопление сообщений для отправки пачкой.
+
+    Одинаковые сообщения разным пользователям объединяются в один messages.send с peer_ids,
+    остальные вызовы упаковываются в execute по EXECUTE_MAX_CALLS штук.
+    Порядок сообщений для каждого пользователя сохраняется.
+    """
+
+    def __init__(self):
+        # [(параметры сообщения без получателя, [получатели])]
+        self.calls = []
+        # индекс последнего вызова с таким же текстом, клавиатурой и вложениями
+        self.last_call_by_content: {tuple: int} = {}
+        # индекс последнего вызова, в который попало сообщение пользователю
+        self.last_call_by_user: {str: int} = {}
+        # пачка отправляется с наивысшим приоритетом из входящих в неё сообщений
+        self.priority = PRIORITY_NORMAL
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, values: dict, priority: int = PRIORITY_NORMAL):
+        self.priority = min(self.priority, priority)
+        values = values.copy()
+        # id получателя приходит и числом (событие), и строкой (chat_id): приводим к одному виду
+        user_id = str(values.pop('user_id'))
+        content = (values.get('message'), values.get('keyboard'), values.get('attachment'))
+
+        call_index = self.last_call_by_content.get(content)
+        if call_index is not None:
+            peer_ids = self.calls[call_index][1]
+            # сообщение можно присоединить к более раннему вызову, только если оно не обгонит
+            # предыдущие сообщения этому пользователю
+            if user_id not in peer_ids and len(peer_ids) < PEER_IDS_MAX \
+                    and self.last_call_by_user.get(user_id, -1) < call_index:
+                peer_ids.append(user_id)
+                self.last_call_by_user[user_id] = call_index
+                return
+
+        self.calls.append((values, [user_id]))
+        call_index = len(self.calls) - 1
+        self.last_call_by_content[content] = call_index
+        self.last_call_by_user[user_id] = call_index
+
+    def get_requests(self) -> list:
+        """
+        Запросы к Вк для отправки накопленных сообщений: [(метод, параметры, все получатели запроса)].
+        """
+        send_calls = []
+        for values, peer_ids in self.calls:
+            values = values.copy()
+            if len(peer_ids) == 1:
+                values['user_id'] = peer_ids[0]
+            else:
+                values['peer_ids'] = ','.join(peer_ids)
+            send_calls.append((values, peer_ids))
+
+        if len(send_calls) == 1:
+            values, peer_ids = send_calls[0]
+            return [('messages.send', values, tuple(peer_ids))]
+
+        requests = []
+        for i in range(0, len(send_calls), EXECUTE_MAX_CALLS):
+            chunk = send_calls[i: i + EXECUTE_MAX_CALLS]
+            code = get_execute_code([values for values, _ in chunk])
+            recipients = tuple(dict.fromkeys(peer_id for _, peer_ids in chunk for peer_id in peer_ids))
+            requests.append(('execute', {'code': code}, recipients))
+        return requests
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих сообщений бота.
+    Внутри batch() сообщения накапливаются и отправляются при выходе из блока (отдельно для каждого потока).
+    Если блок завершился исключением, накопленные сообщения отбрасываются: они описывают изменения,
+    которые откатились вместе с транзакцией.
+    post(метод, параметры, получатели, приоритет) выполняет запрос, получатели - id строками.
+    """
+
+    def __init__(self, post):
+        self.post = post
+        self.local = threading.local()
+
+    @property
+    def current_batch(self) -> MessageBatch:
+        return getattr(self.local, 'batch', None)
+
+    @contextmanager
+    def batch(self):
+        if self.current_batch is not None:
+            # вложенный блок отправляется вместе с внешним
+            yield
+            return
+
+        self.local.batch = MessageBatch()
+        try:
+            yield
+        except BaseException:
+            self.local.batch = None
+            raise
+        message_batch = self.local.batch
+        self.local.batch = None
+        self.flush(message_batch)
+
+    def send(self, values: dict, priority: int = PRIORITY_NORMAL):
+        if self.current_batch is not None:
+            self.current_batch.add(values, priority)
+        else:
+            self.post('messages.send', values, (str(values['user_id']),), priority)
+
+    def flush(self, message_batch: MessageBatch):
+        for method, values, recipients in message_batch.get_requests():
+            self.post(method, values, recipients, message_batch.priority)
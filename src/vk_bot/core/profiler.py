@@ -0,0 +1,109 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection
+
+from config.logger import logger
+from vk_bot.core import metrics
+
+# списки параметров разной длины (id IN (%s, %s, ...)) дают одну сигнатуру
+PARAMS_LIST_RE = re.compile(r'%s(?:, %s)+')
+# управление транзакциями повторяется в каждом atomic и не считается N+1
+TRANSACTION_RE = re.compile(r'^\s*(BEGIN|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK|COMMIT)\b', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_query_signature(sql: str) -> str:
+    """
+    Сигнатура запроса: SQL без значений параметров. Одинаковые сигнатуры в одном событии - признак N+1.
+    """
+    return PARAMS_LIST_RE.sub('%s, ...', sql)
+
+
+class EventProfile:
+    """
+    Запросы к БД одного события, для connection.execute_wrapper.
+    """
+
+    def __init__(self, label: str = 'event'):
+        self.label = label
+        self.signatures = Counter()
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.signatures[get_query_signature(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def queries_count(self) -> int:
+        return sum(self.signatures.values())
+
+    def get_duplicates(self, min_count: int = 2) -> list:
+        """
+        Повторяющиеся запросы: [(сигнатура, количество)] по убыванию количества.
+        """
+        return [(signature, count) for signature, count in self.signatures.most_common()
+                if count >= min_count and not TRANSACTION_RE.match(signature)]
+
+
+class EventProfiler:
+    """
+    Профилирование запросов к БД при обработке событий.
+
+    Для каждого события считаются запросы, их сигнатуры и время обработки с меткой обработчика
+    (этап игры или следующий шаг). При превышении бюджета запросов или повторов одного запроса
+    пишется предупреждение, в режиме raise выбрасывается QueryBudgetExceeded (для тестов и бенчмарков).
+    Бюджет 0 - без ограничения.
+    """
+
+    def __init__(self, query_budget: int = 0, duplicate_budget: int = 0, mode: str = 'warn'):
+        if mode not in ('warn', 'raise'):
+            raise ValueError(f'Неизвестный режим бюджета запросов: {mode}')
+        self.query_budget = query_budget
+        self.duplicate_budget = duplicate_budget
+        self.mode = mode
+        self.local = threading.local()
+
+    @contextmanager
+    def profile(self, label: str = 'event'):
+        profile = EventProfile(label)
+        self.local.profile = profile
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                yield profile
+        finally:
+            self.local.profile = None
+            profile.duration = time.perf_counter() - start
+            metrics.event_db_queries.observe(profile.queries_count, profile.label)
+            metrics.event_seconds.observe(profile.duration, profile.label)
+        self.check(profile)
+
+    def set_label(self, label: str):
+        """
+        Метка обработчика текущего события, становится известна после загрузки пользователя.
+        """
+        profile = getattr(self.local, 'profile', None)
+        if profile:
+            profile.label = label
+
+    def check(self, profile: EventProfile):
+        problems = []
+        if self.query_budget and profile.queries_count > self.query_budget:
+            problems.append(f'запросов {profile.queries_count} при бюджете {self.query_budget}')
+        if self.duplicate_budget:
+            for signature, count in profile.get_duplicates(self.duplicate_budget + 1)[:3]:
+                problems.append(f'запрос повторён {count} раз: {signature[:300]}')
+        if not problems:
+            return
+
+        message = f'Превышен бюджет запросов [{profile.label}, {profile.duration:.3f} с]: ' + '; '.join(problems)
+        if self.mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+
+import vk_api
+from requests import RequestException
+from vk_api.exceptions import ApiError, ApiHttpError, TOO_MANY_RPS_CODE
+
+from config.logger import logger
+from vk_bot.core import metrics
+
+# приоритеты запросов: при нехватке лимита первыми уходят запросы с меньшим значением
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# ошибки Вк, после которых запрос можно повторить: слишком много запросов в секунду, внутренняя ошибка сервера
+RETRY_ERROR_CODES = {TOO_MANY_RPS_CODE, 10}
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов (token bucket) с очередью по приоритетам.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        # количество ожидающих запросов каждого приоритета
+        self.waiting = [0, 0, 0]
+
+    def acquire(self, priority: int = PRIORITY_NORMAL):
+        """
+        Ожидание разрешения на запрос.
+        """
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    has_higher_priority = any(self.waiting[:priority])
+                    if self.tokens >= 1 and not has_higher_priority:
+                        self.tokens -= 1
+                        return
+                    timeout = None if has_higher_priority else (1 - self.tokens) / self.rate
+                    self.condition.wait(timeout)
+            finally:
+                self.waiting[priority] -= 1
+                self.condition.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+buckets: {str: TokenBucket} = {}
+buckets_lock = threading.Lock()
+
+
+def get_bucket(token: str, rate: float) -> TokenBucket:
+    """
+    Общий лимит для всех клиентов с одним токеном.
+    """
+    with buckets_lock:
+        if token not in buckets:
+            buckets[token] = TokenBucket(rate)
+        return buckets[token]
+
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """
+    VkApi с общим лимитом запросов на токен, приоритетами и повтором запросов
+    с экспоненциальной задержкой и случайным разбросом.
+    """
+
+    # частоту запросов ограничивает TokenBucket, а не задержка vk_api
+    RPS_DELAY = 0
+
+    def __init__(self, *args, rps: float = 3, max_retries: int = 5, retry_delay: float = 0.5,
+                 max_retry_delay: float = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bucket = get_bucket(self.token['access_token'], rps)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # vk_api выполняет запросы строго по одному, ограничиваем только количество одновременных запросов
+        self.lock = threading.BoundedSemaphore(max(int(rps), 1))
+        # повтор запроса выполняется здесь, а не бесконечным циклом vk_api
+        del self.error_handlers[TOO_MANY_RPS_CODE]
+
+    def method(self, method, values=None, captcha_sid=None, captcha_key=None, raw=False,
+               priority: int = PRIORITY_NORMAL):
+        attempt = 0
+        while True:
+            self.bucket.acquire(priority)
+            start = time.perf_counter()
+            try:
+                response = super().method(method, values, captcha_sid=captcha_sid, captcha_key=captcha_key, raw=raw)
+                metrics.vk_api_requests_total.inc(method, 'ok')
+                return response
+            except ApiError as e:
+                metrics.vk_api_requests_total.inc(method, f'error_{e.code}')
+                if e.code not in RETRY_ERROR_CODES or attempt >= self.max_retries:
+                    raise
+                error = e
+            except ApiHttpError as e:
+                status_code = e.response.status_code
+                metrics.vk_api_requests_total.inc(method, f'http_{status_code}')
+                # ошибку запроса (4xx) повтор не исправит, ошибка сервера Вк (5xx) обычно временная
+                if status_code < 500 or attempt >= self.max_retries:
+                    raise
+                error = e
+            except RequestException as e:
+                metrics.vk_api_requests_total.inc(method, 'network_error')
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            finally:
+                metrics.vk_api_request_seconds.observe(time.perf_counter() - start, method)
+
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f'{method}: {error}. Повтор через {delay:.2f} сек.')
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,172 @@
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    """
+    Минимальный клиент протокола Redis (RESP) без сторонних зависимостей.
+    """
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/0', timeout: float = 5):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname or '127.0.0.1'
+        self.port = parsed_url.port or 6379
+        self.password = parsed_url.password
+        self.db = int(parsed_url.path.strip('/') or 0)
+        self.timeout = timeout
+        self.connection = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def execute(self, *args):
+        with self.lock:
+            try:
+                return self._execute(args)
+            except (OSError, EOFError):
+                # соединение могло быть закрыто сервером, пробуем переподключиться один раз
+                self.close()
+                return self._execute(args)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+        self.connection = None
+        self.file = None
+
+    def _execute(self, args):
+        if not self.connection:
+            self._connect()
+        self._send(args)
+        return self._read()
+
+    def _connect(self):
+        self.connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.file = self.connection.makefile('rb')
+        if self.password:
+            self._send(('AUTH', self.password))
+            self._read()
+        if self.db:
+            self._send(('SELECT', self.db))
+            self._read()
+
+    def _send(self, args):
+        self.connection.sendall(encode_command(args))
+
+    def _read(self):
+        return read_reply(self.file)
+
+
+def encode_command(args) -> bytes:
+    parts = [f'*{len(args)}\r\n'.encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(f'${len(arg)}\r\n'.encode() + arg + b'\r\n')
+    return b''.join(parts)
+
+
+def read_reply(file):
+    line = file.readline()
+    if not line:
+        raise EOFError('Соединение закрыто')
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b'+':
+        return payload.decode()
+    if prefix == b'-':
+        raise RespError(payload.decode())
+    if prefix == b':':
+        return int(payload)
+    if prefix == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = file.read(length + 2)[:-2]
+        return data
+    if prefix == b'*':
+        length = int(payload)
+        if length < 0:
+            return None
+        return [read_reply(file) for _ in range(length)]
+    raise RespError(f'Неизвестный ответ: {line!r}')
+
+
+class LocalRespServer(socketserver.ThreadingTCPServer):
+    """
+    Локальная замена Redis для разработки и проверки без внешних сервисов.
+    Поддерживает только команды, которые использует бот: PING, SELECT, SET (EX), GET, GETDEL, DEL.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 6379)):
+        super().__init__(address, LocalRespHandler)
+        self.data: {bytes: tuple} = {}
+        self.lock = threading.Lock()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name='local-resp-server', daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, key: bytes):
+        value, expires = self.data.get(key, (None, None))
+        if expires and expires < time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+
+class LocalRespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (EOFError, OSError):
+                return
+            try:
+                reply = self.execute(command)
+            except Exception as e:
+                reply = RespError(str(e))
+            self.wfile.write(encode_reply(reply))
+
+    def execute(self, command: list):
+        name = command[0].upper()
+        server: LocalRespServer = self.server
+        with server.lock:
+            if name in (b'PING', b'SELECT', b'AUTH'):
+                return 'PONG' if name == b'PING' else 'OK'
+            if name == b'SET':
+                expires = None
+                if len(command) == 5 and command[3].upper() == b'EX':
+                    expires = time.monotonic() + int(command[4])
+                server.data[command[1]] = (command[2], expires)
+                return 'OK'
+            if name == b'GET':
+                return server.get(command[1])
+            if name == b'GETDEL':
+                value = server.get(command[1])
+                server.data.pop(command[1], None)
+                return value
+            if name == b'DEL':
+                return sum(1 for key in command[1:] if server.data.pop(key, None) is not None)
+        raise RespError(f'ERR unknown command {name.decode()}')
+
+
+def encode_reply(reply) -> bytes:
+    if isinstance(reply, RespError):
+        return f'-{reply}\r\n'.encode()
+    if isinstance(reply, str):
+        return f'+{reply}\r\n'.encode()
+    if isinstance(reply, int):
+        return f':{reply}\r\n'.encode()
+    if reply is None:
+        return b'$-1\r\n'
+    return f'${len(reply)}\r\n'.encode() + reply + b'\r\n'
@@ -0,0 +1,89 @@
+import re
+from typing import Callable, Union
+
+
+def normalize_command(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def normalize_prefix(prefix: str) -> str:
+    """
+    Нормализация префикса как команды, но с сохранением разделителя в конце:
+    префикс 'подключиться к игре ' не должен совпадать с текстом 'подключиться к игрек'.
+    """
+    normalized = normalize_command(prefix)
+    if normalized and prefix[-1:].isspace():
+        normalized += ' '
+    return normalized
+
+
+class Routes:
+    def __init__(self):
+        self.commands: {str: Callable} = {}
+        # дерево префиксов: символ -> узел, обработчик префикса хранится в узле по ключу None
+        self.prefixes: dict = {}
+        self.patterns: [tuple] = []
+
+
+class CommandRouter:
+    """
+    Маршрутизация текстовых команд бота по состоянию диалога.
+
+    Обработчики регистрируются декораторами при импорте модуля. Поиск обработчика:
+    точное совпадение нормализованного текста (словарь), самый длинный зарегистрированный префикс
+    (дерево префиксов, время зависит только от длины текста) и регулярные выражения в порядке регистрации.
+    """
+
+    def __init__(self):
+        self.states: {str: Routes} = {}
+
+    def command(self, *texts: str, state: str = None):
+        def decorator(handler):
+            routes = self._get_routes(state)
+            for text in texts:
+                routes.commands[normalize_command(text)] = handler
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str, state: str = None):
+        def decorator(handler):
+            routes = self._get_routes(state)
+            for prefix in prefixes:
+                node = routes.prefixes
+                for char in normalize_prefix(prefix):
+                    node = node.setdefault(char, {})
+                node[None] = handler
+            return handler
+        return decorator
+
+    def regex(self, pattern: str, state: str = None):
+        def decorator(handler):
+            self._get_routes(state).patterns.append((re.compile(pattern), handler))
+            return handler
+        return decorator
+
+    def resolve(self, text: str, state: str = None) -> Union[Callable, None]:
+        routes = self.states.get(state)
+        if not routes:
+            return
+        command = normalize_command(text)
+
+        handler = routes.commands.get(command)
+        if handler:
+            return handler
+
+        node = routes.prefixes
+        for char in command:
+            node = node.get(char)
+            if node is None:
+                break
+            handler = node.get(None, handler)
+        if handler:
+            return handler
+
+        for pattern, handler in routes.patterns:
+            if pattern.search(command):
+                return handler
+
+    def _get_routes(self, state: str) -> Routes:
+        return self.states.setdefault(state, Routes())
@@ -0,0 +1,74 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import reduce
+from operator import or_
+from typing import Union
+
+from django.db.models import Q
+
+from vk_bot import models
+
+# количество очков, при котором игра с ведущим заканчивается
+WINNING_SCORE = 40
+
+
+@dataclass
+class HostRoundResult:
+    users: list
+    round_scores: dict = field(default_factory=dict)
+    won_user: Union[models.VkUser, None] = None
+
+
+def score_host_round(game: models.Game) -> HostRoundResult:
+    """
+    Подсчёт очков круга игры с ведущим.
+
+    Ответы и карты игроков загружаются одним запросом, очки считаются в памяти,
+    а результат записывается одним bulk_update и одним удалением отправленных карт из рук.
+    """
+    users = list(game.users.select_related('sent_card'))
+    not_host_users = [user for user in users if not user.is_game_host]
+
+    card_owners = {user.sent_card.attachment_data: user for user in users if user.sent_card}
+    answers_count = Counter(user.answer for user in not_host_users)
+
+    host_card_answers_count = 0
+    round_scores = {}
+    for answer, attachment_data in enumerate(game.current_attachment_data, start=1):
+        card_owner = card_owners.get(attachment_data)
+        if not card_owner:
+            continue
+        if card_owner.is_game_host:
+            host_card_answers_count += answers_count[answer]
+        else:
+            round_scores[card_owner] = round_scores.get(card_owner, 0) + answers_count[answer]
+
+    # если карту ведущего не угадал никто или угадали все, очки получают все, кроме ведущего
+    if host_card_answers_count == 0 or host_card_answers_count >= len(not_host_users):
+        for user in users:
+            round_scores[user] = 0 if user.is_game_host else 2
+    else:
+        for user in users:
+            if user.is_game_host:
+                round_scores[user] = 2
+            else:
+                round_scores.setdefault(user, 0)
+
+    result = HostRoundResult(users=users, round_scores=round_scores)
+    sent_cards = []
+    for user in users:
+        user.current_score += round_scores[user]
+        if user.current_score >= WINNING_SCORE:
+            result.won_user = user
+
+        if user.sent_card_id:
+            sent_cards.append(Q(vkuser_id=user.id, image_id=user.sent_card_id))
+        user.is_game_host = False
+        user.answered = False
+        user.sent_card = None
+        user.answer = None
+
+    if sent_cards:
+        models.VkUser.cards_in_hand.through.objects.filter(reduce(or_, sent_cards)).delete()
+    models.VkUser.objects.bulk_update(users, ['current_score', 'is_game_host', 'answered', 'sent_card', 'answer'])
+    return result
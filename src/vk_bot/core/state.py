@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Union
+
+from django.utils import timezone
+
+from vk_bot import models
+from vk_bot.core.resp import RespClient
+
+
+@dataclass
+class NextStep:
+    """
+    Запланированный обработчик следующего события пользователя: имя метода VkBot и его аргументы.
+    """
+    name: str
+    args: list = field(default_factory=list)
+    kwargs: dict = field(default_factory=dict)
+
+    def dumps(self) -> str:
+        return json.dumps({'name': self.name, 'args': self.args, 'kwargs': self.kwargs}, ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, data: Union[str, bytes]) -> 'NextStep':
+        return cls(**json.loads(data))
+
+
+class StateStore(ABC):
+    """
+    Хранилище запланированных обработчиков (NextStep) пользователей.
+    Обработчик удаляется через ttl секунд, если пользователь так и не ответил.
+    """
+
+    def __init__(self, ttl: int = 60 * 60):
+        self.ttl = ttl
+
+    @abstractmethod
+    def set(self, user_id, next_step: NextStep):
+        pass
+
+    @abstractmethod
+    def pop(self, user_id) -> Union[NextStep, None]:
+        """
+        Получение и удаление обработчика. Обработчик получит только один из одновременных вызовов.
+        """
+
+    @abstractmethod
+    def delete(self, user_id):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """
+    Хранение в памяти процесса. Состояние теряется при перезапуске.
+    """
+
+    def __init__(self, ttl: int = 60 * 60):
+        super().__init__(ttl)
+        self.steps: {str: tuple} = {}
+        self.lock = threading.Lock()
+        self.last_purge = time.monotonic()
+
+    def set(self, user_id, next_step: NextStep):
+        now = time.monotonic()
+        with self.lock:
+            self.steps[str(user_id)] = (next_step.dumps(), now + self.ttl)
+            if now - self.last_purge > self.ttl:
+                self.steps = {key: value for key, value in self.steps.items() if value[1] > now}
+                self.last_purge = now
+
+    def pop(self, user_id) -> Union[NextStep, None]:
+        with self.lock:
+            data, expires = self.steps.pop(str(user_id), (None, None))
+        if data and expires > time.monotonic():
+            return NextStep.loads(data)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.steps.pop(str(user_id), None)
+
+
+class DatabaseStateStore(StateStore):
+    """
+    Хранение в таблице БД, общей для всех воркеров.
+    """
+
+    def set(self, user_id, next_step: NextStep):
+        now = timezone.now()
+        models.NextStepState.objects.update_or_create(chat_id=str(user_id), defaults={
+            'name': next_step.name,
+            'args': next_step.args,
+            'kwargs': next_step.kwargs,
+            'expires': now + timedelta(seconds=self.ttl),
+        })
+        models.NextStepState.objects.filter(expires__lt=now).delete()
+
+    def pop(self, user_id) -> Union[NextStep, None]:
+        state = models.NextStepState.objects.filter(chat_id=str(user_id), expires__gte=timezone.now()).first()
+        if not state:
+            return
+        # удаление по id и времени жизни: если обработчик уже забрал другой воркер, удалено будет 0 строк
+        deleted = models.NextStepState.objects.filter(id=state.id, expires=state.expires).delete()[0]
+        if deleted:
+            return NextStep(name=state.name, args=state.args, kwargs=state.kwargs)
+
+    def delete(self, user_id):
+        models.NextStepState.objects.filter(chat_id=str(user_id)).delete()
+
+
+class RedisStateStore(StateStore):
+    """
+    Хранение в Redis или совместимом сервере (для GETDEL нужен Redis 6.2+).
+    """
+
+    key_prefix = 'vk_bot:next_step:'
+
+    def __init__(self, url: str, ttl: int = 60 * 60):
+        super().__init__(ttl)
+        self.client = RespClient(url)
+
+    def set(self, user_id, next_step: NextStep):
+        self.client.execute('SET', self.key_prefix + str(user_id), next_step.dumps(), 'EX', self.ttl)
+
+    def pop(self, user_id) -> Union[NextStep, None]:
+        data = self.client.execute('GETDEL', self.key_prefix + str(user_id))
+        if data:
+            return NextStep.loads(data)
+
+    def delete(self, user_id):
+        self.client.execute('DEL', self.key_prefix + str(user_id))
+
+
+def get_state_store(backend: str, ttl: int, redis_url: str = None) -> StateStore:
+    if backend == 'memory':
+        return MemoryStateStore(ttl=ttl)
+    if backend == 'db':
+        return DatabaseStateStore(ttl=ttl)
+    if backend == 'redis':
+        return RedisStateStore(redis_url, ttl=ttl)
+    raise ValueError(f'Неизвестное хранилище состояния: {backend}')
@@ -0,0 +1,117 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config.logger import logger
+from vk_bot.core import metrics
+from vk_bot.core.ratelimit import PRIORITY_HIGH, PRIORITY_LOW
+
+# максимальное количество id в одном запросе users.get
+USERS_GET_MAX_IDS = 1000
+
+
+@dataclass
+class CachedUser:
+    id: int
+    name: str
+    expires: float
+
+
+class UserCache:
+    """
+    Кэш пользователей Вк: chat_id -> id пользователя в БД и имя.
+    Хранит не больше max_size записей (вытесняются давно не использованные),
+    имя считается устаревшим через ttl секунд.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.users: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id) -> CachedUser:
+        with self.lock:
+            cached_user = self.users.get(chat_id)
+            if cached_user:
+                self.users.move_to_end(chat_id)
+            return cached_user
+
+    def set(self, chat_id, user_id: int, name: str):
+        with self.lock:
+            self.users[chat_id] = CachedUser(id=user_id, name=name, expires=time.monotonic() + self.ttl)
+            self.users.move_to_end(chat_id)
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+    def set_name(self, chat_id, name: str):
+        with self.lock:
+            cached_user = self.users.get(chat_id)
+            if cached_user:
+                cached_user.name = name
+                cached_user.expires = time.monotonic() + self.ttl
+
+    def delete(self, chat_id):
+        with self.lock:
+            self.users.pop(chat_id, None)
+
+
+class UserNamesRefresher:
+    """
+    Фоновое обновление имён пользователей.
+    Запрошенные id собираются в пачки до USERS_GET_MAX_IDS и загружаются одним запросом users.get.
+    Поток обновляет только кэш, а в БД имя сохраняет обработчик следующего события пользователя:
+    с SQLite в БД пишет только поток обработки событий (см. get_workers_count).
+    """
+
+    def __init__(self, vk_api, cache: UserCache, interval: float = 0.5):
+        self.vk_api = vk_api
+        self.cache = cache
+        self.interval = interval
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.thread = None
+        metrics.queue_size.set_function('user_names', lambda: {('user_names',): len(self.pending)})
+
+    def schedule(self, chat_id):
+        with self.condition:
+            self.pending.add(chat_id)
+            if not self.thread:
+                self.thread = threading.Thread(target=self._work, name='vk-user-names', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            # даём накопиться запросам от соседних событий
+            time.sleep(self.interval)
+            with self.condition:
+                chat_ids = list(self.pending)[:USERS_GET_MAX_IDS]
+                self.pending.difference_update(chat_ids)
+            try:
+                self.refresh(chat_ids)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def load_names(self, chat_ids: list, priority: int = PRIORITY_LOW) -> dict:
+        """
+        Имена пользователей из Вк: chat_id (строкой) -> имя.
+        """
+        vk_users = self.vk_api.method('users.get', {'user_ids': ','.join(str(chat_id) for chat_id in chat_ids)},
+                                      priority=priority)
+        return {str(vk_user['id']): f'{vk_user["first_name"]} {vk_user["last_name"]}' for vk_user in vk_users}
+
+    def fetch_name(self, chat_id) -> str:
+        """
+        Загрузка имени одного пользователя сразу, без очереди.
+        """
+        return self.load_names([chat_id], priority=PRIORITY_HIGH).get(str(chat_id), '')
+
+    def refresh(self, chat_ids: list):
+        for chat_id, name in self.load_names(chat_ids).items():
+            self.cache.set_name(int(chat_id), name)
@@ -0,0 +1,67 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from vk_bot import models
+from vk_bot.core.benchmark import benchmark_database
+from vk_bot.core.importer import AlbumImage, iter_album_images, sync_album_images
+
+
+class FakePhotosApi:
+    """
+    Ответы photos.get для альбома из count фотографий с задержкой сети latency секунд.
+    """
+
+    def __init__(self, count: int, latency: float):
+        self.count = count
+        self.latency = latency
+        self.requests_count = 0
+
+    def method(self, method, values):
+        self.requests_count += 1
+        time.sleep(self.latency)
+        offset, count = values['offset'], values['count']
+        items = [{'owner_id': -1, 'id': i, 'text': ', '.join(random.sample(WORDS, 3)) if i % 10 else ''}
+                 for i in range(offset, min(offset + count, self.count))]
+        return {'count': self.count, 'items': items}
+
+
+WORDS = [f'Слово{i}' for i in range(1000)]
+
+
+class Command(BaseCommand):
+    help = 'Замер импорта альбома пользовательской коллекции на временной БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, default=5000)
+        parser.add_argument('--latency', type=float, default=0.3)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            vk_api = FakePhotosApi(options['photos'], options['latency'])
+            collection = models.Collection.objects.create(standard=False, album_url='https://vk.com/album-1_1')
+
+            start = time.perf_counter()
+            album_images = list(iter_album_images(vk_api, collection.album_url))
+            fetch_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = sync_album_images(collection, album_images)
+            import_time = time.perf_counter() - start
+
+            self.stdout.write(f'Запросов photos.get: {vk_api.requests_count}, загрузка: {fetch_time:.3f} с')
+            self.stdout.write(f'Изображений: {result.created}, слов: {models.ImageWord.objects.count()}, '
+                              f'запись в БД: {import_time:.3f} с')
+
+            # повторная синхронизация альбома, в котором изменилась одна фотография
+            album_images[0] = AlbumImage(attachment_data=album_images[0].attachment_data, words=['новое'])
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                result = sync_album_images(collection, album_images)
+                sync_time = time.perf_counter() - start
+            writes_count = sum(1 for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')))
+            self.stdout.write(f'Повторная синхронизация: {result}, запросов на запись: {writes_count}, '
+                              f'{sync_time:.3f} с')
@@ -0,0 +1,58 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from vk_bot import models
+from vk_bot.core.benchmark import benchmark_database, measure, format_stats
+
+
+class Command(BaseCommand):
+    help = 'Замер времени запросов, выполняемых при обработке каждого события, на временной БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--images', type=int, default=100000)
+        parser.add_argument('--games', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.fill_database(options['users'], options['images'], options['games'])
+
+            users_count, images_count = options['users'], options['images']
+            lookups = {
+                'Пользователь по chat_id': models.VkUser.objects.filter(chat_id='1'),
+                'Изображение по attachment_data': models.Image.objects.filter(attachment_data='photo-1_1'),
+                'Поиск игры': models.Game.objects.filter(status__in=['waiting', 'started'], single=False)[:5],
+            }
+            for name, queryset in lookups.items():
+                self.stdout.write(f'{name}:\n{queryset.explain()}\n')
+
+            results = {
+                'Пользователь по chat_id': measure(
+                    lambda: models.VkUser.objects.get(chat_id=str(random.randint(1, users_count))),
+                    options['repeat']),
+                'Изображение по attachment_data': measure(
+                    lambda: models.Image.objects.get(attachment_data=f'photo-1_{random.randint(1, images_count)}'),
+                    options['repeat']),
+                'Поиск игры': measure(
+                    lambda: list(models.Game.objects.filter(status__in=['waiting', 'started'], single=False)[:5]),
+                    options['repeat']),
+            }
+            for name, stats in results.items():
+                self.stdout.write(f'{name}: {format_stats(stats)}')
+
+    def fill_database(self, users_count, images_count, games_count):
+        self.stdout.write(f'Заполнение БД: {users_count} пользователей, {images_count} изображений, {games_count} игр')
+        models.VkUser.objects.bulk_create((models.VkUser(chat_id=str(i), name=f'user {i}')
+                                           for i in range(1, users_count + 1)), batch_size=10000)
+
+        collection = models.Collection.objects.create(standard=True)
+        models.Image.objects.bulk_create((models.Image(collection=collection, attachment_data=f'photo-1_{i}')
+                                          for i in range(1, images_count + 1)), batch_size=10000)
+
+        creator = models.VkUser.objects.first()
+        statuses = ['finished'] * 97 + ['waiting', 'started', 'creating']
+        models.Game.objects.bulk_create((models.Game(collection=collection, creator=creator,
+                                                     status=random.choice(statuses), single=random.random() < 0.5)
+                                         for _ in range(games_count)), batch_size=10000)
@@ -0,0 +1,187 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from config.settings import VK_BOT_WORKERS
+from vk_bot import models
+from vk_bot.core.benchmark import benchmark_database, get_timings_stats
+from vk_bot.core.bot import VkBot
+from vk_bot.core.fake_vk import FakeEvent, FakeLongPoll, FakeVkClientFactory
+
+MODES = ('single', 'multiplayer', 'host')
+
+
+class BenchBot(VkBot):
+    """
+    Бот, отмечающий обработанные события, количество запросов к БД при их обработке и ошибки.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors_count = 0
+        self.errors_lock = threading.Lock()
+
+    def send_error_message(self, user_id):
+        with self.errors_lock:
+            self.errors_count += 1
+        super().send_error_message(user_id)
+
+    def handle_event(self, event: FakeEvent):
+        queries = []
+        try:
+            with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                super().handle_event(event)
+        finally:
+            event.queries_count = len(queries)
+            event.processed.set()
+
+
+class GameDriver:
+    """
+    Игроки одной игры: отправляют сообщения боту и ждут их обработки.
+    """
+
+    def __init__(self, long_poll: FakeLongPoll, mode: str, user_ids: list):
+        self.long_poll = long_poll
+        self.mode = mode
+        self.user_ids = user_ids
+        self.game_id = None
+        self.round_timings = []
+        self.events_count = 0
+        self.queries_count = 0
+
+    def say(self, *messages) -> list:
+        """
+        Одновременная отправка сообщений [(id пользователя, текст)].
+        """
+        events = [FakeEvent(user_id, text) for user_id, text in messages]
+        for event in events:
+            self.long_poll.put(event)
+        for event in events:
+            event.processed.wait()
+        return events
+
+    def play_round(self, messages_steps: list):
+        start = time.perf_counter()
+        for messages in messages_steps:
+            for event in self.say(*messages):
+                self.events_count += 1
+                self.queries_count += event.queries_count
+        self.round_timings.append((time.perf_counter() - start) * 1000)
+
+    def setup(self):
+        creator, *players = self.user_ids
+        if self.mode == 'single':
+            self.say((creator, 'Начать'))
+        else:
+            self.say((creator, 'Мультиплеер'))
+            self.say((creator, 'Создать игру' if self.mode == 'multiplayer' else 'Создать игру с ведущим'))
+            self.say((creator, 'Стандартная'))
+            game_id = self.get_game_id()
+            self.say(*[(user_id, f'Подключиться к игре #{game_id}') for user_id in players])
+            self.say((creator, 'Начать игру'))
+        self.game_id = self.get_game_id()
+
+    def play(self, rounds: int):
+        for _ in range(rounds):
+            if self.get_game_id() != self.game_id:
+                # игра завершилась раньше: закончились карты или есть победитель
+                return
+            if self.mode == 'single':
+                self.play_round([[(self.user_ids[0], '1')], [(self.user_ids[0], 'Следующий круг')]])
+            elif self.mode == 'multiplayer':
+                self.play_round([[(user_id, '1') for user_id in self.user_ids]])
+            else:
+                host = models.VkUser.objects.filter(current_game_id=self.game_id, is_game_host=True) \
+                    .values_list('chat_id', flat=True).first()
+                if not host:
+                    return
+                host = int(host)
+                players = [user_id for user_id in self.user_ids if user_id != host]
+                self.play_round([[(host, '1')], [(host, 'слово')],
+                                 [(user_id, '1') for user_id in players],
+                                 [(user_id, '2') for user_id in players]])
+
+    def get_game_id(self):
+        return models.VkUser.objects.filter(chat_id=str(self.user_ids[0])) \
+            .values_list('current_game_id', flat=True).first()
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест бота на временной БД с имитацией Вк: одновременные игры всех режимов. ' \
+           'Событий в секунду, время круга, запросы к БД и вызовы API Вк на круг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--games', type=int, default=10, help='количество одновременных игр')
+        parser.add_argument('--players', type=int, default=3, help='игроков в мультиплеере и игре с ведущим')
+        parser.add_argument('--rounds', type=int, default=5, help='кругов в каждой игре')
+        parser.add_argument('--workers', type=int, default=VK_BOT_WORKERS, help='воркеров обработки событий')
+        parser.add_argument('--latency', type=float, default=0, help='время ответа API Вк, мс')
+
+    def handle(self, *args, **options):
+        with benchmark_database(concurrent=True):
+            self.create_collection(options['games'] * max(options['players'], 1) * (options['rounds'] + 10) + 100)
+            for mode_index, mode in enumerate(options['modes']):
+                self.run_mode(mode, mode_index, options)
+            # соединения воркеров закрыты, временную БД можно удалить
+            connection.close()
+
+    def create_collection(self, images_count: int):
+        collection = models.Collection.objects.create(standard=True)
+        images = models.Image.objects.bulk_create(
+            models.Image(collection=collection, attachment_data=f'photo-1_{i}') for i in range(images_count))
+        models.ImageWord.objects.bulk_create(
+            models.ImageWord(image=image, name=f'слово{i}') for i, image in enumerate(images))
+
+    def run_mode(self, mode: str, mode_index: int, options: dict):
+        client_factory = FakeVkClientFactory(latency=options['latency'] / 1000)
+        vk_api = client_factory.bot_api
+        long_poll = client_factory.long_poll
+        bot = BenchBot(client_factory)
+        polling = threading.Thread(target=bot.polling, kwargs={'workers': options['workers']}, daemon=True)
+        polling.start()
+
+        players = 1 if mode == 'single' else options['players']
+        drivers = [GameDriver(long_poll, mode, [(mode_index + 1) * 1000000 + game * 1000 + i + 1
+                                                for i in range(players)])
+                   for game in range(options['games'])]
+        # круги всех игр начинаются одновременно, после создания игр
+        phase = {}
+        barrier = threading.Barrier(len(drivers), action=lambda: phase.update(
+            start=time.perf_counter(), api_calls=vk_api.get_calls_count()))
+
+        def play(driver: GameDriver):
+            try:
+                driver.setup()
+            finally:
+                barrier.wait()
+            driver.play(options['rounds'])
+
+        threads = [threading.Thread(target=play, args=(driver,)) for driver in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - phase['start']
+        api_calls = vk_api.get_calls_count() - phase['api_calls']
+
+        long_poll.stop()
+        polling.join()
+
+        round_timings = [timing for driver in drivers for timing in driver.round_timings]
+        rounds_count = len(round_timings)
+        if not rounds_count:
+            self.stdout.write(f'{mode}: ни одного круга не сыграно')
+            return
+        events_count = sum(driver.events_count for driver in drivers)
+        queries_count = sum(driver.queries_count for driver in drivers)
+        stats = get_timings_stats(round_timings)
+        self.stdout.write(f'{mode}: игр {len(drivers)}, игроков {players}, кругов {rounds_count}, '
+                          f'событий/с {events_count / duration:.1f}, '
+                          f'круг p50 {stats["p50"]:.1f} мс, p99 {stats["p99"]:.1f} мс, '
+                          f'запросов к БД на круг {queries_count / rounds_count:.1f}, '
+                          f'вызовов API Вк на круг {api_calls / rounds_count:.1f}, '
+                          f'ошибок обработки {bot.errors_count}')
@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from vk_bot import models
+from vk_bot.core.benchmark import benchmark_database, get_timings_stats, format_stats
+from vk_bot.core.scoring import score_host_round
+
+
+class Command(BaseCommand):
+    help = 'Замер подсчёта очков круга игры с ведущим на временной БД: количество запросов и время'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[2, 5, 10, 25, 50])
+        parser.add_argument('--repeat', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            for players_count in options['players']:
+                game = self.create_game(players_count)
+                timings = []
+                queries_count = 0
+                for _ in range(options['repeat']):
+                    self.prepare_round(game)
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        score_host_round(game)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries_count = len(queries)
+                self.stdout.write(f'Игроков: {players_count}, запросов: {queries_count}, '
+                                  f'{format_stats(get_timings_stats(timings))}')
+
+    def create_game(self, players_count: int) -> models.Game:
+        collection = models.Collection.objects.create(standard=True)
+        users = models.VkUser.objects.bulk_create(
+            models.VkUser(chat_id=f'{players_count}_{i}', name=f'user {i}') for i in range(players_count))
+        models.Image.objects.bulk_create(
+            models.Image(collection=collection, attachment_data=f'photo-{players_count}_{i}')
+            for i in range(players_count))
+        game = models.Game.objects.create(collection=collection, creator=users[0], status='started', single=False)
+        game.users.set(users)
+        return game
+
+    def prepare_round(self, game: models.Game):
+        users = list(game.users.all())
+        images = list(game.collection.images.all())
+        random.shuffle(images)
+        for i, (user, image) in enumerate(zip(users, images)):
+            user.cards_in_hand.add(image)
+            user.sent_card = image
+            user.is_game_host = i == 0
+            user.answered = i != 0
+            user.answer = None if i == 0 else random.randint(1, len(users))
+            user.current_score = 0
+        models.VkUser.objects.bulk_update(users, ['sent_card', 'is_game_host', 'answered', 'answer', 'current_score'])
+        game.current_attachment_data = [image.attachment_data for image in images]
+        game.save()
@@ -0,0 +1,53 @@
+import re
+
+from django.core.management.base import BaseCommand
+
+from vk_bot.core.benchmark import measure, format_stats
+from vk_bot.core.router import CommandRouter
+
+
+def handler(*args):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Замер времени поиска обработчика команды в зависимости от количества зарегистрированных команд'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commands', type=int, nargs='+', default=[10, 100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        texts = {
+            'Команда': 'Создать игру с ведущим',
+            'Префикс': 'Подключиться к игре #12345',
+            'Регулярное выражение': 'https://vk.com/id1',
+            'Неизвестный текст': 'какой-то произвольный текст от пользователя',
+        }
+        for commands_count in options['commands']:
+            router = self.get_router(commands_count)
+            for name, text in texts.items():
+                assert router.resolve(text) or name == 'Неизвестный текст'
+                stats = measure(lambda: router.resolve(text), options['repeat'])
+                self.stdout.write(f'Команд: {commands_count}, {name}: {format_stats(stats)}')
+
+            # та же маршрутизация цепочкой if/elif, как было до роутера
+            chain = [f'команда {i}' for i in range(commands_count)] + ['создать игру с ведущим']
+            stats = measure(lambda: self.resolve_by_chain(chain, texts['Неизвестный текст']), options['repeat'])
+            self.stdout.write(f'Команд: {commands_count}, цепочка if/elif, неизвестный текст: {format_stats(stats)}')
+
+    def get_router(self, commands_count: int) -> CommandRouter:
+        router = CommandRouter()
+        router.command(*(f'Команда {i}' for i in range(commands_count)), 'Создать игру с ведущим')(handler)
+        router.prefix(*(f'Префикс {i} ' for i in range(commands_count)), 'Подключиться к игре ')(handler)
+        router.regex(r'vk\.com')(handler)
+        return router
+
+    def resolve_by_chain(self, chain: list, text: str):
+        for command in chain:
+            if text.lower() == command:
+                return handler
+        if 'подключиться к игре ' in text.lower():
+            return handler
+        if re.search(r'vk\.com', text):
+            return handler
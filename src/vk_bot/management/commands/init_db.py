@@ -6,6 +6,7 @@ from django.core.management.base import BaseCommand
 from config.logger import logger
 from config.settings import BASE_DIR
 from vk_bot import models
+from vk_bot.core.importer import AlbumImage, sync_album_images
 
 
 class Command(BaseCommand):
@@ -16,13 +17,14 @@ class Command(BaseCommand):
         with open(os.path.join(BASE_DIR, 'data/standard_images.json'), encoding='utf-8') as f:
             standard_images = json.load(f)
 
-        models.Collection.objects.filter(standard=True).delete()
-        collection = models.Collection.objects.create(standard=True)
-        for image_data in standard_images:
-            image = collection.images.create(
-                attachment_data=image_data['attachment_data'],
-            )
-            image_words = [models.ImageWord(image=image, name=word) for word in image_data['words']]
-            models.ImageWord.objects.bulk_create(image_words)
+        # коллекция не пересоздаётся: изображения обновляются по attachment_data, чтобы не прерывать идущие игры
+        collection = models.Collection.objects.filter(standard=True).first()
+        if not collection:
+            collection = models.Collection.objects.create(standard=True)
 
-        logger.info('База данных инициализирована')
+        result = sync_album_images(collection, (AlbumImage(attachment_data=image_data['attachment_data'],
+                                                           words=image_data['words'])
+                                                for image_data in standard_images))
+
+        logger.info(f'База данных инициализирована: добавлено изображений {result.created}, '
+                    f'обновлено {result.updated}, удалено {result.retired}, восстановлено {result.restored}')
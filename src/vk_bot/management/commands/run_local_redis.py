@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from vk_bot.core.resp import LocalRespServer
+
+
+class Command(BaseCommand):
+    help = 'Запуск локальной замены Redis для проверки VK_BOT_STATE_BACKEND=redis без внешних сервисов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        server = LocalRespServer((options['host'], options['port']))
+        self.stdout.write(f'Сервер запущен на {options["host"]}:{options["port"]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,47 @@
+import random
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from config.settings import VK_CALLBACK_SECRET
+
+
+class Command(BaseCommand):
+    help = 'Отправка события Callback API на локальный сервер бота (имитация Вк)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('text', nargs='*', help='Текст сообщения')
+        parser.add_argument('--url', default='http://127.0.0.1:8000/vk/callback/')
+        parser.add_argument('--user-id', type=int, default=1)
+        parser.add_argument('--group-id', type=int, default=1)
+        parser.add_argument('--secret', default=VK_CALLBACK_SECRET)
+        parser.add_argument('--confirmation', action='store_true', help='Отправить запрос подтверждения сервера')
+
+    def handle(self, *args, **options):
+        data = {
+            'group_id': options['group_id'],
+            'event_id': f'{random.getrandbits(64):x}',
+            'v': '5.131',
+        }
+        if options['secret']:
+            data['secret'] = options['secret']
+
+        if options['confirmation']:
+            data['type'] = 'confirmation'
+        else:
+            data['type'] = 'message_new'
+            data['object'] = {
+                'message': {
+                    'id': random.randint(1, 2 ** 31),
+                    'date': int(time.time()),
+                    'out': 0,
+                    'peer_id': options['user_id'],
+                    'from_id': options['user_id'],
+                    'text': ' '.join(options['text']),
+                },
+                'client_info': {'keyboard': True, 'inline_keyboard': True},
+            }
+
+        response = requests.post(options['url'], json=data, timeout=10)
+        self.stdout.write(f'{response.status_code}: {response.text}')
@@ -1,14 +1,31 @@
+import asyncio
+
 from django.core.management.base import BaseCommand
 
-from config.settings import DEBUG
-from vk_bot.core.bot import bot
+from config.settings import DEBUG, VK_BOT_METRICS_PORT, VK_BOT_METRICS_TEXTFILE, VK_BOT_WORKERS
+from vk_bot.core import metrics
+from vk_bot.core.async_runtime import AsyncBotRuntime
+from vk_bot.core.bot import get_bot
 
 
 class Command(BaseCommand):
     help = 'Запуск Вк бота'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Запуск бота в асинхронном режиме')
+
     def handle(self, *args, **options):
-        if DEBUG:
+        if VK_BOT_METRICS_PORT:
+            metrics.start_http_server(VK_BOT_METRICS_PORT)
+        if VK_BOT_METRICS_TEXTFILE:
+            metrics.start_textfile_writer(VK_BOT_METRICS_TEXTFILE)
+
+        bot = get_bot()
+        bot.connect()
+        if options['use_async']:
+            asyncio.run(AsyncBotRuntime(bot, handlers=VK_BOT_WORKERS).run())
+        elif DEBUG:
             bot.polling()
         else:
             bot.infinity_polling()
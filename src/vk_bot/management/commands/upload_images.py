@@ -1,41 +1,112 @@
 import json
 import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from django.core.management.base import BaseCommand
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from vk_api.upload import FilesOpener
 
 from config.logger import logger
 from config.settings import BASE_DIR
-from vk_bot.core.bot import bot
+from vk_bot.core.clients import VkClientFactory
+
+STANDARD_IMAGES_PATH = os.path.join(BASE_DIR, 'data/standard_images.json')
 
 
 class Command(BaseCommand):
+    help = 'Загрузка стандартных изображений в Вк. Загруженные файлы сохраняются в standard_images.json, ' \
+           'повторный запуск продолжает загрузку с места остановки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=5,
+                            help='количество фотографий, загружаемых на один сервер загрузки '
+                                 '(фотографии отправляются по одной, пачка экономит запросы адреса сервера)')
+        parser.add_argument('--encoding', default='cp1251', help='кодировка data/words.txt')
 
     def handle(self, *args, **options):
-        with open(os.path.join(BASE_DIR, r'data/words.txt')) as f:
-            uploaded_files = []
-            all_words = []
-            i = 0
+        with open(os.path.join(BASE_DIR, r'data/words.txt'), encoding=options['encoding']) as f:
+            files_words = {}
             for file_data in f.readlines():
-                i += 1
+                if not file_data.strip():
+                    continue
                 file_name, words = file_data.split('\t')
-                words = words.replace('\n', '').split()
+                files_words[file_name] = words.replace('\n', '').split()
+
+        uploaded = self.load_checkpoint(files_words)
+        pending = [file_name for file_name in files_words if file_name not in uploaded]
+        total = len(files_words)
+        logger.info(f'Уже загружено: {len(uploaded)}/{total}, осталось: {len(pending)}')
+
+        batch_size = options['batch_size']
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        failed_count = 0
+        local = threading.local()
+        self.vk_api = VkClientFactory().create_bot_api()
 
-                response = bot.upload.photo_messages(os.path.join(BASE_DIR,f'data/standard_images/{file_name}'))[0]
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(self.upload_batch, local, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                attachments = future.result()
+                failed_count += len(futures[future]) - len(attachments)
+
+                uploaded.update(attachments)
+                self.save_checkpoint(files_words, uploaded)
+                logger.info(f'Загружено: {len(uploaded)}/{total}')
+
+        all_words = {word for file_name in uploaded for word in files_words[file_name]}
+        with open(os.path.join(BASE_DIR, 'data/standard_words.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(all_words), f, indent=4, ensure_ascii=False)
+
+        if failed_count:
+            raise CommandError(f'Не удалось загрузить изображений: {failed_count}. '
+                               f'Запустите команду повторно, чтобы загрузить оставшиеся')
+
+    def upload_batch(self, local: threading.local, file_names: list) -> dict:
+        """
+        Загрузка пачки фотографий через один сервер загрузки.
+        Адрес сервера запрашивается один раз на пачку, но фотографии отправляются по одной: сервер загрузки
+        в сообщения принимает одну фотографию на запрос, остальные файлы запроса не сохраняются.
+        Поэтому каждая фотография сохраняется отдельным вызовом photos.saveMessagesPhoto.
+        При ошибке возвращаются уже загруженные фотографии, остальные загрузятся при повторном запуске.
+        """
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+
+        attachments = {}
+        try:
+            upload_url = self.vk_api.method('photos.getMessagesUploadServer')['upload_url']
+            for file_name in file_names:
+                with FilesOpener(os.path.join(BASE_DIR, f'data/standard_images/{file_name}')) as photo_files:
+                    upload_response = local.session.post(upload_url, files=photo_files).json()
+                response = self.vk_api.method('photos.saveMessagesPhoto', upload_response)[0]
                 owner_id = response['owner_id']
                 photo_id = response['id']
                 access_key = response['access_key']
-                attachment = f'photo{owner_id}_{photo_id}_{access_key}'
-                logger.info(f'Загружено: {attachment} ({i}/98)')
+                attachments[file_name] = f'photo{owner_id}_{photo_id}_{access_key}'
+        except Exception:
+            logger.error(traceback.format_exc())
+        return attachments
 
-                all_words += words
-                uploaded_files.append({
-                    'file_name': file_name,
-                    'words': words,
-                    'attachment_data': attachment
-                })
+    def load_checkpoint(self, files_words: dict) -> dict:
+        if not os.path.exists(STANDARD_IMAGES_PATH):
+            return {}
+        with open(STANDARD_IMAGES_PATH, encoding='utf-8') as f:
+            standard_images = json.load(f)
+        return {image_data['file_name']: image_data['attachment_data'] for image_data in standard_images
+                if image_data['file_name'] in files_words and image_data.get('attachment_data')}
 
-        with open(os.path.join(BASE_DIR, 'data/standard_images.json'), 'w', encoding='utf-8') as f:
-            json.dump(uploaded_files, f, indent=4, ensure_ascii=False)
+    def save_checkpoint(self, files_words: dict, uploaded: dict):
+        uploaded_files = [{
+            'file_name': file_name,
+            'words': words,
+            'attachment_data': uploaded[file_name]
+        } for file_name, words in files_words.items() if file_name in uploaded]
 
-        with open(os.path.join(BASE_DIR, 'data/standard_words.json'), 'w', encoding='utf-8') as f:
-            json.dump(list(set(all_words)), f, indent=4, ensure_ascii=False)
+        # запись через временный файл, чтобы прерванная запись не испортила сохранённый прогресс
+        tmp_path = STANDARD_IMAGES_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(uploaded_files, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, STANDARD_IMAGES_PATH)
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.5 on 2026-10-18 17:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicate_users(apps, schema_editor):
+    """
+    Удаление повторяющихся пользователей перед добавлением уникальности chat_id.
+    Остаётся последний изменённый пользователь (в нём текущее состояние игры), созданные дубликатами игры
+    переходят к нему.
+    """
+    VkUser = apps.get_model('vk_bot', 'VkUser')
+    Game = apps.get_model('vk_bot', 'Game')
+    duplicate_chat_ids = VkUser.objects.values('chat_id').annotate(users_count=Count('id')) \
+        .filter(users_count__gt=1).values_list('chat_id', flat=True)
+    for chat_id in list(duplicate_chat_ids):
+        kept_user, *duplicates = VkUser.objects.filter(chat_id=chat_id).order_by('-update_date', '-id')
+        duplicate_ids = [user.id for user in duplicates]
+        Game.objects.filter(creator_id__in=duplicate_ids).update(creator=kept_user)
+        VkUser.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vk_bot', '0020_rename_current_card_number_vkuser_answer'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='image',
+            name='attachment_data',
+            field=models.CharField(db_index=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='chat_id',
+            field=models.CharField(max_length=15, unique=True, verbose_name='chat_id'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'single'], name='game_status_single_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.5 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vk_bot', '0021_vkuser_chat_id_unique_image_attachment_data_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NextStepState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=15, unique=True, verbose_name='chat_id')),
+                ('name', models.CharField(max_length=150, verbose_name='Обработчик')),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Следующий шаг пользователя',
+                'verbose_name_plural': 'Следующие шаги пользователей',
+                'ordering': ['-update_date'],
+            },
+        ),
+    ]
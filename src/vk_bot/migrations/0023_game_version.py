@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vk_bot', '0022_nextstepstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vk_bot', '0024_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='retired',
+            field=models.BooleanField(default=False),
+        ),
+    ]
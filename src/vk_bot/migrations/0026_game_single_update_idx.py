@@ -0,0 +1,21 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vk_bot', '0025_image_retired'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='game',
+            name='game_status_single_idx',
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['single', 'update_date', 'status'], name='game_single_update_idx'),
+        ),
+    ]
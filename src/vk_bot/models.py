@@ -2,7 +2,7 @@ from django.db import models
 
 
 class VkUser(models.Model):
-    chat_id = models.CharField(max_length=15, verbose_name='chat_id')
+    chat_id = models.CharField(max_length=15, unique=True, verbose_name='chat_id')
     name = models.CharField(max_length=150, verbose_name='Имя', blank=True)
 
     current_game = models.ForeignKey('Game', on_delete=models.SET_NULL, null=True, blank=True, related_name='users')
@@ -44,7 +44,9 @@ class Collection(models.Model):
 class Image(models.Model):
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, related_name='images')
 
-    attachment_data = models.CharField(max_length=1000)
+    attachment_data = models.CharField(max_length=1000, db_index=True)
+    # фотография удалена из альбома коллекции: не используется в новых кругах, но остаётся для идущих игр
+    retired = models.BooleanField(default=False)
 
     creation_date = models.DateTimeField(auto_now_add=True)
     update_date = models.DateTimeField(auto_now=True)
@@ -97,6 +99,9 @@ class Game(models.Model):
 
     with_host = models.BooleanField(default=False)
 
+    # увеличивается при каждом переходе между кругами и стадиями, см. claim_game_transition
+    version = models.PositiveIntegerField(default=0)
+
     creation_date = models.DateTimeField(auto_now_add=True)
     update_date = models.DateTimeField(auto_now=True)
 
@@ -104,3 +109,48 @@ class Game(models.Model):
         verbose_name = 'Игра'
         verbose_name_plural = 'Игры'
         ordering = ['-update_date']
+        indexes = [
+            # поиск игр для подключения: status__in, single=False, сортировка по update_date из Meta.ordering
+            models.Index(fields=['single', 'update_date', 'status'], name='game_single_update_idx'),
+        ]
+
+
+class NextStepState(models.Model):
+    chat_id = models.CharField(max_length=15, unique=True, verbose_name='chat_id')
+    name = models.CharField(max_length=150, verbose_name='Обработчик')
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    expires = models.DateTimeField(db_index=True)
+
+    creation_date = models.DateTimeField(auto_now_add=True)
+    update_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Следующий шаг пользователя'
+        verbose_name_plural = 'Следующие шаги пользователей'
+        ordering = ['-update_date']
+
+    def __str__(self):
+        return f'{self.chat_id} ({self.name})'
+
+
+class BackgroundJob(models.Model):
+    chat_id = models.CharField(max_length=15, db_index=True, verbose_name='chat_id')
+    name = models.CharField(max_length=150, verbose_name='Обработчик')
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed'),
+                 ('cancelled', 'cancelled')],
+        default='pending', max_length=20, db_index=True)
+
+    creation_date = models.DateTimeField(auto_now_add=True)
+    update_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-update_date']
+
+    def __str__(self):
+        return f'{self.chat_id} ({self.name}, {self.status})'
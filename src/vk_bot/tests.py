@@ -1,3 +1,497 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import queue
+from unittest import mock
 
-# Create your tests here.
+import vk_api
+from django.test import SimpleTestCase, TestCase
+from vk_api.exceptions import ApiError, ApiHttpError, TOO_MANY_RPS_CODE
+
+from config.logger import NonBlockingQueueHandler
+from vk_bot import models, views
+from vk_bot.core.bot import VkBot, router
+from vk_bot.core.callback import RecentEventIds
+from vk_bot.core.deck import CollectionCache, Deck, DeckCache
+from vk_bot.core.fake_vk import FakeEvent, FakeVkClientFactory
+from vk_bot.core.importer import AlbumImage
+from vk_bot.core.jobs import Job, JobStepEvent
+from vk_bot.core.outbound import OutboundQueue
+from vk_bot.core.profiler import EventProfiler, QueryBudgetExceeded
+from vk_bot.core.ratelimit import RateLimitedVkApi, TokenBucket
+from vk_bot.core.resp import LocalRespServer, RespClient, encode_command, read_reply
+from vk_bot.core.router import CommandRouter
+from vk_bot.core.state import MemoryStateStore, NextStep, RedisStateStore
+
+# запросы к БД при первом сообщении нового пользователя: создание пользователя и одиночной игры, первый круг
+START_QUERIES_COUNT = 17
+
+
+class RecordingProfiler(EventProfiler):
+    """
+    Профилировщик, запоминающий профили обработанных событий.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiles = []
+
+    def check(self, profile):
+        self.profiles.append(profile)
+        super().check(profile)
+
+
+class FakeVkBot(VkBot):
+    """
+    Бот на имитации Вк, считающий ошибки обработки событий.
+    """
+
+    def __init__(self):
+        super().__init__(FakeVkClientFactory())
+        self.errors_count = 0
+
+    def send_error_message(self, user_id):
+        self.errors_count += 1
+        super().send_error_message(user_id)
+
+    def say(self, user_id: int, text: str):
+        self.handle_event(FakeEvent(user_id, text))
+
+
+def create_standard_collection(images_count: int = 30) -> models.Collection:
+    collection = models.Collection.objects.create(standard=True)
+    images = models.Image.objects.bulk_create(
+        models.Image(collection=collection, attachment_data=f'photo-1_{i}') for i in range(images_count))
+    models.ImageWord.objects.bulk_create(
+        models.ImageWord(image=image, name=f'слово{i}') for i, image in enumerate(images))
+    return collection
+
+
+class FakeClock:
+    """
+    Замена модуля time, в которой время идёт только при ожидании.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def get_user(user_id: int) -> models.VkUser:
+    return models.VkUser.objects.get(chat_id=str(user_id))
+
+
+class EventQueriesTestCase(TestCase):
+    def setUp(self):
+        create_standard_collection()
+        self.bot = FakeVkBot()
+
+    def test_start_command_queries(self):
+        self.bot.profiler = RecordingProfiler(query_budget=START_QUERIES_COUNT, mode='raise')
+        self.bot.say(1, 'Начать')
+
+        profile, = self.bot.profiler.profiles
+        self.assertEqual(profile.label, 'menu')
+        self.assertEqual(profile.queries_count, START_QUERIES_COUNT)
+        self.assertEqual(self.bot.errors_count, 0)
+
+    def test_query_budget_exceeded(self):
+        self.bot.profiler = RecordingProfiler(query_budget=1, mode='raise')
+        with self.assertRaises(QueryBudgetExceeded):
+            self.bot.say(1, 'Начать')
+
+
+class GameFlowTestCase(TestCase):
+    def setUp(self):
+        create_standard_collection()
+        self.bot = FakeVkBot()
+
+    def test_single_game(self):
+        self.bot.say(1, 'Начать')
+        game = get_user(1).current_game
+        self.assertEqual(game.status, 'started')
+
+        for _ in range(3):
+            self.bot.say(1, '1')
+            self.bot.say(1, 'Следующий круг')
+        self.bot.say(1, 'Завершить игру')
+
+        game.refresh_from_db()
+        self.assertEqual(game.status, 'finished')
+        self.assertIsNone(get_user(1).current_game)
+        self.assertEqual(self.bot.errors_count, 0)
+
+    def test_multiplayer_game(self):
+        self.bot.say(1, 'Мультиплеер')
+        self.bot.say(1, 'Создать игру')
+        self.bot.say(1, 'Стандартная')
+        game = get_user(1).current_game
+        self.bot.say(2, 'Основное меню')
+        self.bot.say(2, f'Подключиться к игре #{game.id}')
+        self.bot.say(1, 'Начать игру')
+        game.refresh_from_db()
+        self.assertEqual(game.status, 'started')
+        first_word = game.current_word
+
+        self.bot.say(1, '1')
+        self.bot.say(2, '2')
+        game.refresh_from_db()
+        # все ответили: начался следующий круг
+        self.assertNotEqual(game.current_word, first_word)
+        self.assertFalse(get_user(1).answered)
+
+        self.bot.say(2, 'Покинуть игру')
+        self.bot.say(1, 'Покинуть игру')
+        game.refresh_from_db()
+        self.assertEqual(game.status, 'finished')
+        self.assertEqual(self.bot.errors_count, 0)
+
+
+class AlbumImportStepTestCase(TestCase):
+    album_url = 'https://vk.com/album-2_1'
+
+    def setUp(self):
+        create_standard_collection()
+        self.bot = FakeVkBot()
+        self.bot.say(1, 'Начать')
+        self.step = JobStepEvent('1', 'import_album_step', [
+            self.album_url, [AlbumImage(f'photo-2_{i}', [f'кот{i}']) for i in range(6)]])
+
+    def test_step_submitted_to_event_handlers(self):
+        events = []
+        self.bot.event_submitter = events.append
+        self.bot.submit_job_step(Job(self.bot.jobs, 1, '1', 'import_album_job'), 'import_album_step', self.album_url, [])
+
+        event, = events
+        self.assertEqual((event.user_id, event.name), (1, 'import_album_step'))
+
+    def test_step_skipped_after_cancel(self):
+        self.bot.handle_event(self.step)
+        self.assertFalse(models.Collection.objects.filter(album_url=self.album_url).exists())
+
+        self.bot.register_next_step_by_user_id('1', self.bot.waiting_album_import_step)
+        self.bot.handle_event(self.step)
+        collection = models.Collection.objects.get(album_url=self.album_url)
+        self.assertEqual(collection.images.count(), 6)
+        self.assertEqual(get_user(1).current_game.collection, collection)
+        self.assertEqual(self.bot.errors_count, 0)
+
+
+class DeckTestCase(TestCase):
+    def setUp(self):
+        self.collection = create_standard_collection(images_count=12)
+        self.snapshots = CollectionCache()
+
+    def test_draw_circle(self):
+        deck = Deck(self.snapshots.get(self.collection))
+        right_image_id, word, image_ids = deck.draw_circle()
+
+        self.assertEqual(len(set(image_ids)), 5)
+        self.assertIn(right_image_id, image_ids)
+        image_words = dict(models.ImageWord.objects.filter(image_id__in=image_ids).values_list('image_id', 'name'))
+        self.assertEqual([image_id for image_id in image_ids if image_words[image_id] == word], [right_image_id])
+        # взятые карты уходят из колоды
+        self.assertEqual(len(deck), 7)
+        self.assertEqual(deck.used, set(image_ids))
+
+        second_image_ids = deck.draw_circle()[2]
+        self.assertFalse(set(image_ids) & set(second_image_ids))
+        # на третий круг карт не хватает
+        self.assertIsNone(deck.draw_circle())
+
+    def test_used_and_retired_images_excluded(self):
+        image_ids = list(self.collection.images.order_by('id').values_list('id', flat=True))
+        models.Image.objects.filter(id=image_ids[0]).update(retired=True)
+        deck = Deck(self.snapshots.get(self.collection), used_image_ids=image_ids[1:3])
+
+        self.assertEqual(len(deck), 9)
+        self.assertFalse(set(deck.deal(20)) & set(image_ids[:3]))
+        self.assertEqual(len(deck), 0)
+
+    def test_snapshot_reloaded_after_collection_update(self):
+        snapshot = self.snapshots.get(self.collection)
+        self.assertIs(self.snapshots.get(models.Collection.objects.get(id=self.collection.id)), snapshot)
+
+        models.Image.objects.filter(id=snapshot.image_ids[0]).update(retired=True)
+        # update_date изменилась: снимок загружается заново
+        self.collection.save()
+        new_snapshot = self.snapshots.get(self.collection)
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(len(new_snapshot), 11)
+
+    def test_deck_reloaded_after_collection_update(self):
+        game = models.Game.objects.create(collection=self.collection, creator=models.VkUser.objects.create(chat_id='1'),
+                                          single=True)
+        deck_cache = DeckCache()
+        with mock.patch('vk_bot.core.deck.collection_snapshots', self.snapshots):
+            deck = deck_cache.get(game)
+            self.assertIs(deck_cache.get(game), deck)
+
+            self.collection.save()
+            self.assertIsNot(deck_cache.get(game), deck)
+
+
+class OutboundQueueTestCase(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+        self.outbound = OutboundQueue(
+            lambda method, values, recipients, priority: self.requests.append((method, recipients)))
+
+    def test_batch_discarded_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            with self.outbound.batch():
+                self.outbound.send({'user_id': 1, 'message': 'Следующий круг'})
+                raise RuntimeError()
+        self.assertEqual(self.requests, [])
+
+        with self.outbound.batch():
+            self.outbound.send({'user_id': 1, 'message': 'Следующий круг'})
+        self.assertEqual(self.requests, [('messages.send', ('1',))])
+
+    def test_batch_requests_list_all_recipients(self):
+        with self.outbound.batch():
+            self.outbound.send({'user_id': 1, 'message': 'Круг 1'})
+            self.outbound.send({'user_id': '2', 'message': 'Круг 2'})
+            self.outbound.send({'user_id': 3, 'message': 'Круг 3'})
+            # id числом и строкой - один получатель
+            self.outbound.send({'user_id': '1', 'message': 'Круг 1'})
+        self.assertEqual(self.requests, [('execute', ('1', '2', '3'))])
+
+
+class CallbackViewTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dispatcher = mock.Mock()
+        for patcher in (mock.patch.object(views, 'VK_CALLBACK_SECRET', 'secret'),
+                        mock.patch.object(views, 'recent_event_ids', RecentEventIds()),
+                        mock.patch.object(views, 'get_dispatcher', return_value=self.dispatcher)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, **data):
+        return self.client.post('/vk/callback/', json.dumps(data), content_type='application/json')
+
+    def message_new(self, event_id: str, secret: str = 'secret'):
+        return self.post(type='message_new', event_id=event_id, secret=secret,
+                         object={'message': {'id': 1, 'from_id': 1, 'peer_id': 1, 'text': 'Начать'}})
+
+    def test_secret_required(self):
+        self.assertEqual(self.message_new('1', secret='wrong').status_code, 403)
+        with mock.patch.object(views, 'VK_CALLBACK_SECRET', ''):
+            self.assertEqual(self.message_new('1', secret='').status_code, 403)
+        self.dispatcher.submit.assert_not_called()
+
+    def test_repeated_event_skipped(self):
+        self.assertEqual(self.message_new('1').content, b'ok')
+        self.assertEqual(self.message_new('1').content, b'ok')
+        self.assertEqual(self.message_new('2').content, b'ok')
+        self.assertEqual(self.dispatcher.submit.call_count, 2)
+
+
+class NonBlockingQueueHandlerTestCase(SimpleTestCase):
+    def test_raw_record_queued_and_dropped_counted(self):
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        record = logging.makeLogRecord({'msg': 'Событие %s', 'args': (1,)})
+        handler.handle(record)
+        handler.handle(logging.makeLogRecord({'msg': 'Отброшено'}))
+
+        queued = handler.queue.get_nowait()
+        # сообщение не отформатировано в потоке, который пишет в лог
+        self.assertIs(queued, record)
+        self.assertEqual((queued.msg, queued.args), ('Событие %s', (1,)))
+        self.assertEqual(handler.dropped, 1)
+
+        handler.handle(logging.makeLogRecord({'msg': 'Следующая'}))
+        self.assertEqual(handler.queue.get_nowait().queue_dropped, 1)
+        self.assertEqual(handler.dropped, 0)
+
+
+class TokenBucketTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('vk_bot.core.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waits_for_refill(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            self.clock.sleep(timeout)
+
+        bucket.condition.wait = wait
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(waits, [])
+
+        # токены кончились: следующий появится через 1 / rate секунд
+        bucket.acquire()
+        self.assertEqual(waits, [0.5])
+        self.assertEqual(bucket.tokens, 0)
+
+    def test_refill_limited_by_capacity(self):
+        bucket = TokenBucket(rate=5, capacity=3)
+        bucket.acquire()
+        self.clock.sleep(60)
+        bucket._refill()
+        self.assertEqual(bucket.tokens, 3)
+
+
+class RateLimitedVkApiTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (mock.patch('vk_bot.core.ratelimit.time', self.clock),
+                        mock.patch('vk_bot.core.ratelimit.random.uniform', return_value=1)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.vk = RateLimitedVkApi(token=f'token-{self.id()}', rps=1000, max_retries=3, retry_delay=0.5,
+                                   max_retry_delay=1.5)
+
+    def api_error(self, code: int) -> ApiError:
+        return ApiError(self.vk, 'users.get', {}, False, {'error_code': code, 'error_msg': 'error'})
+
+    def http_error(self, status_code: int) -> ApiHttpError:
+        return ApiHttpError(self.vk, 'users.get', {}, False, mock.Mock(status_code=status_code))
+
+    def call(self, *responses):
+        with mock.patch.object(vk_api.VkApi, 'method', side_effect=responses) as method:
+            try:
+                return self.vk.method('users.get')
+            finally:
+                self.calls_count = method.call_count
+
+    def test_retry_backoff(self):
+        response = self.call(self.api_error(TOO_MANY_RPS_CODE), self.http_error(502), self.api_error(10), [{}])
+        self.assertEqual(response, [{}])
+        # задержка удваивается и ограничена max_retry_delay
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0, 1.5])
+
+    def test_retries_limited(self):
+        with self.assertRaises(ApiHttpError):
+            self.call(*[self.http_error(503)] * 5)
+        self.assertEqual(self.calls_count, 4)
+
+    def test_client_errors_not_retried(self):
+        with self.assertRaises(ApiHttpError):
+            self.call(self.http_error(404))
+        with self.assertRaises(ApiError):
+            self.call(self.api_error(15))
+        self.assertEqual(self.clock.sleeps, [])
+
+
+class MemoryStateStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('vk_bot.core.state.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = MemoryStateStore(ttl=60)
+
+    def test_user_id_normalized(self):
+        self.store.set(1, NextStep(name='waiting_album_import_step'))
+        self.assertEqual(self.store.pop('1'), NextStep(name='waiting_album_import_step'))
+        self.assertIsNone(self.store.pop(1))
+
+        self.store.set('2', NextStep(name='choosing_collection_by_url_step'))
+        self.store.delete(2)
+        self.assertIsNone(self.store.pop('2'))
+
+    def test_ttl(self):
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step', args=[1], kwargs={'game_id': 2}))
+        self.clock.sleep(59)
+        self.assertEqual(self.store.pop(1).kwargs, {'game_id': 2})
+
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step'))
+        self.clock.sleep(61)
+        self.assertIsNone(self.store.pop(1))
+
+    def test_expired_steps_purged(self):
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step'))
+        self.clock.sleep(61)
+        self.store.set(2, NextStep(name='choosing_collection_by_url_step'))
+        self.assertEqual(list(self.store.steps), ['2'])
+
+
+class RedisStateStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('vk_bot.core.resp.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        server = LocalRespServer(('127.0.0.1', 0))
+        server.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        self.store = RedisStateStore(f'redis://127.0.0.1:{server.server_address[1]}/1', ttl=60)
+        self.addCleanup(self.store.client.close)
+
+    def test_user_id_normalized(self):
+        self.store.set(1, NextStep(name='waiting_album_import_step', args=['Кот']))
+        self.assertEqual(list(self.server.data), [b'vk_bot:next_step:1'])
+        self.assertEqual(self.store.pop('1'), NextStep(name='waiting_album_import_step', args=['Кот']))
+        self.assertIsNone(self.store.pop(1))
+
+        self.store.set('2', NextStep(name='choosing_collection_by_url_step'))
+        self.store.delete(2)
+        self.assertEqual(self.server.data, {})
+
+    def test_ttl(self):
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step'))
+        self.clock.sleep(59)
+        self.assertIsNotNone(self.store.pop(1))
+
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step'))
+        self.clock.sleep(61)
+        self.assertIsNone(self.store.pop(1))
+
+    def test_reconnect(self):
+        self.store.set(1, NextStep(name='choosing_collection_by_url_step'))
+        # соединение разорвано: команда повторяется с новым соединением
+        self.store.client.connection.shutdown(2)
+        self.assertIsNotNone(self.store.pop(1))
+
+
+class RespProtocolTestCase(SimpleTestCase):
+    def test_command_round_trip(self):
+        command = encode_command(('SET', 'vk_bot:next_step:1', 'Кот', 'EX', 60))
+        self.assertEqual(read_reply(io.BytesIO(command)), [b'SET', b'vk_bot:next_step:1', 'Кот'.encode(), b'EX', b'60'])
+
+    def test_client_url(self):
+        client = RespClient('redis://:password@redis:6380/2')
+        self.assertEqual((client.host, client.port, client.password, client.db), ('redis', 6380, 'password', 2))
+
+
+class CommandRouterTestCase(SimpleTestCase):
+    def test_connect_to_game_prefix(self):
+        handler = VkBot.connect_to_game_command
+        self.assertIs(router.resolve('Подключиться  к игре #5', state='menu'), handler)
+        # без разделителя после префикса команда не распознаётся
+        self.assertIsNone(router.resolve('подключиться к игре', state='menu'))
+        self.assertIsNone(router.resolve('подключиться к игрек #5', state='menu'))
+
+    def test_invite_link_regex(self):
+        handler = VkBot.invite_person_command
+        self.assertIs(router.resolve('https://vk.com/id1', state='waiting_game'), handler)
+        self.assertIs(router.resolve('Позови VK.COM/durov', state='waiting_game'), handler)
+        self.assertIsNone(router.resolve('vkXcom/durov', state='waiting_game'))
+        self.assertIs(router.resolve('Начать игру', state='waiting_game'), VkBot.start_game_command)
+
+    def test_longest_prefix(self):
+        test_router = CommandRouter()
+        test_router.prefix('игра ')(min)
+        test_router.prefix('игра с ведущим ')(max)
+        self.assertIs(test_router.resolve('игра #1'), min)
+        self.assertIs(test_router.resolve('Игра с ведущим #1'), max)
+        self.assertIs(test_router.resolve('игра с другом #1'), min)
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from vk_bot import views
+
+urlpatterns = [
+    path('callback/', views.callback, name='vk_callback'),
+]
@@ -1,3 +1,74 @@
-from django.shortcuts import render
+import json
+import threading
 
-# Create your views here.
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from config.logger import logger
+from config.settings import VK_CALLBACK_CONFIRMATION_CODE, VK_CALLBACK_SECRET, VK_BOT_WORKERS, VK_BOT_QUEUE_SIZE
+from vk_bot.core.callback import RecentEventIds, parse_callback_event
+from vk_bot.core.dispatcher import EventDispatcher, get_workers_count
+
+dispatcher: EventDispatcher = None
+dispatcher_lock = threading.Lock()
+recent_event_ids = RecentEventIds()
+
+
+def get_dispatcher() -> EventDispatcher:
+    """
+    Пул воркеров, обрабатывающих события Callback API в этом процессе.
+    Создаётся под блокировкой: первые запросы приходят одновременно в разных потоках сервера.
+    """
+    global dispatcher
+    if not dispatcher:
+        with dispatcher_lock:
+            if not dispatcher:
+                from vk_bot.core.bot import get_bot
+
+                bot = get_bot()
+                new_dispatcher = EventDispatcher(bot.handle_event, workers=get_workers_count(VK_BOT_WORKERS),
+                                                 queue_size=VK_BOT_QUEUE_SIZE, get_key=bot.get_event_key)
+                new_dispatcher.start()
+                bot.event_submitter = new_dispatcher.submit
+                dispatcher = new_dispatcher
+    return dispatcher
+
+
+@csrf_exempt
+@require_POST
+def callback(request):
+    """
+    Приём событий Вк (Callback API).
+    Событие подтверждается сразу, а обрабатывается воркерами в фоне.
+    Если очередь воркера заполнена, событие отбрасывается: ожидание места задержало бы ответ и Вк повторил бы запрос.
+    Без VK_CALLBACK_SECRET запросы не принимаются: иначе любой, кто знает адрес, мог бы писать от имени пользователей.
+    """
+    if not VK_CALLBACK_SECRET:
+        logger.error('Запрос Callback API отклонён: не задан VK_CALLBACK_SECRET')
+        return HttpResponseForbidden('forbidden')
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest('bad request')
+
+    if not constant_time_compare(str(data.get('secret', '')), VK_CALLBACK_SECRET):
+        return HttpResponseForbidden('forbidden')
+
+    if data.get('type') == 'confirmation':
+        return HttpResponse(VK_CALLBACK_CONFIRMATION_CODE)
+
+    event_id = data.get('event_id')
+    if event_id and not recent_event_ids.add(event_id):
+        logger.debug(f'Пропущен повтор события Callback API: {event_id}')
+        return HttpResponse('ok')
+
+    event = parse_callback_event(data)
+    if event and event.to_me:
+        get_dispatcher().submit(event, block=False)
+    else:
+        logger.debug(f'Пропущено событие Callback API: {data.get("type")}')
+
+    return HttpResponse('ok')